@@ -0,0 +1,662 @@
+# The client's command set on top of asyncFtp, for fanning out over many sessions from one thread:
+# mget/mput/mdelete and mirror keep up to `sessions` transfers or listings in flight at once. Commands
+# take the same text as the command box and return the same (text, level, delay) status as
+# ftpEngine. Large files resume from the same .ftpresume sidecars the threaded engine writes, and
+# dropped transfers are retried on the same backoff schedule (both from resumableTransfer); files
+# of VERIFY_MIN bytes or more are checked against the server's checksum and, with compress=True,
+# transfers are deflated (MODE Z) on servers that offer it, as in the threaded engine. mirror
+# and reverse-mirror skip the same files as mirrorSync, and given a RemoteIndex every listing is
+# saved to it for find. op and pget are only in the threaded engine (see UNSUPPORTED).
+#
+#   engine = AsyncEngine('ftp.example.com', 'user', 'secret', sessions=64)
+#   await engine.start()
+#   status = await engine.execute('mget *.log')
+#   await engine.close()
+
+import asyncio
+import ftplib
+import os
+import posixpath
+import time
+
+import batchCommands
+import checksums
+import dataPath
+import mirrorSync
+import resumableTransfer
+from asyncFtp import AsyncFTP, AsyncPool, Timeouts, isDropped
+from ftpEngine import batchStatus, mirrorStatus, verified
+from listingCache import ListingCache
+from transferMetrics import metrics
+from transferQueue import JobCancelled
+
+SESSIONS = 16
+
+# commands of the threaded engine this one doesn't run, and why
+UNSUPPORTED = {
+    'op': 'it opens the file in a desktop application; use get',
+    'pget': 'its segments each run on a thread of their own; use get, or mget for several files',
+}
+
+
+# run func(item, submit) for every item with at most `workers` running at once; func may submit()
+# more items. Returns [(item, error)] for the ones that failed, like transferQueue.runBounded; a
+# cancelled job stops everything and is re-raised
+async def fanOut(items, func, workers):
+    work = asyncio.Queue()
+    failures = []
+    stop = []
+    for item in items:
+        work.put_nowait(item)
+
+    async def worker():
+        while True:
+            item = await work.get()
+            try:
+                if not stop:
+                    await func(item, work.put_nowait)
+            except Exception as e:
+                failures.append((item, e))
+            except JobCancelled as e:
+                stop.append(e)
+            finally:
+                work.task_done()
+
+    tasks = [asyncio.ensure_future(worker()) for _ in range(workers)]
+    try:
+        await work.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if stop:
+        raise stop[0]
+    return failures
+
+
+async def remoteSize(ftp, name):
+    try:
+        return await ftp.size(name)
+    except ftplib.error_perm:
+        return None
+
+
+async def remoteModified(ftp, name):
+    try:
+        return (await ftp.sendcmd('MDTM ' + name))[4:].strip()
+    except ftplib.error_perm:
+        return None
+
+
+# (algorithm, lowercase hex digest) of a remote file, or None, like checksums.remoteChecksum
+async def remoteChecksum(ftp, name, features):
+    command = checksums.checksumCommand(features)
+    if command is None:
+        return None
+    try:
+        return checksums.parseChecksum(command, await ftp.sendcmd(command + ' ' + name))
+    except ftplib.error_perm:
+        return None
+
+
+# MDTM as seconds since the epoch, like mirrorSync.mdtmTime
+async def mdtmTime(ftp, name):
+    try:
+        return mirrorSync.mlsdTime(await remoteModified(ftp, name) or '')
+    except ValueError:
+        return None
+
+
+# mirrorSync.decide for coroutines: answer(question) is a coroutine function
+async def decide(decision, answer):
+    try:
+        question = next(decision)
+        while True:
+            question = decision.send(await answer(question))
+    except StopIteration as done:
+        return done.value
+
+
+# run attempt() (a coroutine function) until it succeeds, backing off between retryable failures
+# like resumableTransfer.withRetries
+async def withRetries(attempt, retries=resumableTransfer.RETRIES):
+    for tries in range(retries + 1):
+        try:
+            return await attempt()
+        except Exception as e:
+            if tries == retries or not (resumableTransfer.retryable(e) or isDropped(e)):
+                raise
+        await asyncio.sleep(resumableTransfer.backoff(tries))
+
+
+# feed digest the first length bytes of the file at path, for a resumed download
+def hashPrefix(digest, path, length):
+    with open(path, 'rb') as partFile:
+        checksums.updateFromFile(digest, partFile, length)
+
+
+class AsyncEngine:
+
+    def __init__(self, address, username, password, port=21, sessions=SESSIONS, timeouts=None, index=None,
+                 compress=False, verify=True):
+        self.address = address
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeouts = timeouts or Timeouts()
+        self.sessions = sessions
+        self.compress = compress                # MODE Z where the server has it
+        self.verify = verify                    # check transfers against the server's HASH/XCRC/XMD5
+        self.pool = AsyncPool(self.openSession, sessions)
+        self.remoteDir = None
+        self.index = index                      # RemoteIndex every listing is saved to, None if disabled
+        self.listings = ListingCache(ttl=120, maxDirs=64, index=index)
+        self.shown = None                       # (directory, entries) the last command left to show, like find's matches
+        self.handlers = {
+            'cd': self.ftp_cd,
+            'get': self.ftp_get,
+            'put': self.ftp_put,
+            'mirror': self.ftp_mirror,
+            'reverse-mirror': self.ftp_reverse_mirror,
+            'delete': self.ftp_delete,
+            'mget': self.ftp_mget,
+            'mput': self.ftp_mput,
+            'mdelete': self.ftp_mdelete,
+            'rename': self.ftp_rename,
+            'mkdir': self.ftp_mkdir,
+            'rmdir': self.ftp_rmdir,
+            'ls': self.ftp_ls,
+            'find': self.ftp_find,
+        }
+
+    async def openSession(self):
+        session = AsyncFTP(self.timeouts)
+        try:
+            await session.connect(self.address, self.port)
+            await session.login(self.username, self.password)
+        except BaseException:
+            session.close()
+            raise
+        return session
+
+    # log in the first session and find the starting directory
+    async def start(self):
+        session = await self.openSession()
+        await self.pool.add(session)
+        self.remoteDir = await session.pwd()
+        return session.welcome
+
+    async def close(self):
+        await self.pool.close()
+
+    # run one command line; progress(nbytes) is called as data moves. Returns its status, or None
+    async def execute(self, text, progress=None):
+        inputs = text.split(' ', 1)
+        handler = self.handlers.get(inputs[0])
+        if inputs[0] in UNSUPPORTED:
+            return 'Error: "%s" is not available with --engine async: %s' % (inputs[0], UNSUPPORTED[inputs[0]]), 'error', 3000
+        if handler is None:
+            return 'Error: unknown command "' + inputs[0] + '"', 'error', 2000
+        moved = [0]
+        self.shown = None
+
+        def counted(nbytes):
+            moved[0] += nbytes
+            if progress:
+                progress(nbytes)
+
+        started = time.monotonic()
+        outcome = 'failed'
+        try:
+            status = await handler(inputs, counted)
+            outcome = status[1] if status else 'ok'
+            return status
+        except (JobCancelled, asyncio.CancelledError):
+            outcome = 'cancelled'
+            raise
+        finally:
+            metrics.commandDone(text, outcome, time.monotonic() - started, moved[0])
+
+    # current directory and its entries, from the listing cache when it is still fresh
+    async def listing(self):
+        directory = self.remoteDir
+        entries = self.listings.get(directory)
+        if entries is None:
+            started = time.monotonic()
+            entries = await self.pool.run(lambda ftp: ftp.listing('MLST' in self.pool.features), directory)
+            metrics.commandDone('list ' + directory, 'ok', time.monotonic() - started)
+            self.listings.put(directory, entries)
+        return directory, entries
+
+    # ----- transfers -----
+
+    # whether a transfer from offset is deflated, like dataPath.compressing
+    def compressing(self, offset=0):
+        return self.compress and not offset and dataPath.offersModeZ(self.pool.features)
+
+    # the checksum to stream a transfer of size bytes through, or (None, None) if it won't be verified,
+    # like resumableTransfer.streamDigest
+    async def streamDigest(self, ftp, size):
+        if not self.verify or size is None or size < resumableTransfer.VERIFY_MIN:
+            return None, None
+        algorithm, current = checksums.chooseAlgorithm(self.pool.features, ftp.hashAlgorithm)
+        if algorithm != current:
+            try:
+                await ftp.sendcmd('OPTS HASH ' + algorithm)
+                ftp.hashAlgorithm = algorithm
+            except ftplib.error_perm:
+                algorithm = current if current in checksums.HASH_NAMES else None
+        return algorithm, algorithm and checksums.newDigest(algorithm)
+
+    # check a finished transfer against the server's checksum like resumableTransfer.verifyTransfer;
+    # returns the algorithm it was verified with, None if the server couldn't tell
+    async def verifyTransfer(self, ftp, remoteName, algorithm, digest, localName, downloaded):
+        remote = await remoteChecksum(ftp, remoteName, self.pool.features)
+        try:
+            matched = checksums.compareDigest(remoteName, algorithm, digest, remote)
+        except checksums.ChecksumMismatch:
+            resumableTransfer.discardMismatch(localName, downloaded)
+            raise
+        return algorithm if matched else None
+
+    # download remoteName from directory; files of CHECKPOINT bytes or more keep a sidecar so an
+    # interrupted download continues with REST. size saves a SIZE round trip when the listing has it.
+    # Returns the checksum algorithm it was verified with, if any
+    async def download(self, directory, remoteName, localName, progress, size=None):
+
+        async def attempt(ftp):
+            await ftp.setType('I')
+            remoteBytes = size if size is not None else await remoteSize(ftp, remoteName)
+            identity = None
+            offset = 0
+            if remoteBytes is None or remoteBytes >= resumableTransfer.CHECKPOINT:
+                identity = resumableTransfer.downloadIdentity(remoteName, remoteBytes, await remoteModified(ftp, remoteName))
+                offset = resumableTransfer.downloadOffset(localName, identity)
+                if offset and offset >= remoteBytes:
+                    resumableTransfer.clearState(localName)
+                    return None
+            algorithm, digest = await self.streamDigest(ftp, remoteBytes)
+            if digest and offset:                   # the part already on disk, hashed off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, hashPrefix, digest, localName, offset)
+            opened = []
+
+            def accepted():                     # nothing is written locally until the server accepts RETR
+                localFile = open(localName, 'r+b' if offset else 'wb')
+                opened.append(localFile)
+                if identity:
+                    resumableTransfer.saveState(localName, dict(identity, offset=offset))
+                localFile.truncate(offset)
+                localFile.seek(offset)
+                return localFile
+
+            try:
+                await ftp.retrieve('RETR ' + remoteName, accepted, offset or None, progress, digest,
+                                   self.compressing(offset))
+            except BaseException:
+                if identity and opened:
+                    opened[0].flush()
+                    resumableTransfer.saveState(localName, dict(identity, offset=opened[0].tell()))
+                raise
+            finally:
+                if opened:
+                    opened[0].close()
+            if digest:
+                algorithm = await self.verifyTransfer(ftp, remoteName, algorithm, digest, localName, True)
+            if identity:
+                resumableTransfer.clearState(localName)
+            return algorithm
+
+        return await withRetries(lambda: self.pool.run(attempt, directory))
+
+    # upload localName into directory as remoteName, appending to a partial upload the sidecar vouches
+    # for. Returns (size, checksum algorithm it was verified with or None)
+    async def upload(self, directory, localName, remoteName, progress):
+
+        async def attempt(ftp):
+            with open(localName, 'rb') as localFile:
+                info = os.fstat(localFile.fileno())
+                identity = None
+                offset = 0
+                if info.st_size >= resumableTransfer.CHECKPOINT:
+                    identity = resumableTransfer.uploadIdentity(remoteName, info)
+                    if resumableTransfer.sameTransfer(localName, identity):
+                        await ftp.setType('I')
+                        offset = await remoteSize(ftp, remoteName) or 0
+                        if offset > info.st_size:
+                            offset = 0
+                    if offset and offset == info.st_size:
+                        resumableTransfer.clearState(localName)
+                        return info.st_size, None
+                algorithm, digest = await self.streamDigest(ftp, info.st_size)
+                if digest and offset:
+                    await asyncio.get_running_loop().run_in_executor(None, checksums.updateFromFile, digest, localFile, offset)
+                localFile.seek(offset)
+                compress = self.compressing(offset)
+
+                def accepted():                 # no sidecar for an upload the server refuses
+                    if identity:
+                        resumableTransfer.saveState(localName, dict(identity, offset=offset))
+
+                if offset == 0:
+                    await ftp.store('STOR ' + remoteName, localFile, progress=progress, accepted=accepted, digest=digest,
+                                    compress=compress)
+                else:
+                    try:
+                        await ftp.store('APPE ' + remoteName, localFile, progress=progress, accepted=accepted, digest=digest)
+                    except ftplib.error_perm as e:
+                        if not str(e).startswith('50'):         # APPE not implemented: fall back to REST + STOR
+                            raise
+                        await ftp.store('STOR ' + remoteName, localFile, rest=offset, progress=progress,
+                                        accepted=accepted, digest=digest)
+                if digest:
+                    algorithm = await self.verifyTransfer(ftp, remoteName, algorithm, digest, localName, False)
+            if identity:
+                resumableTransfer.clearState(localName)
+            return info.st_size, algorithm
+
+        return await withRetries(lambda: self.pool.run(attempt, directory))
+
+    # whether the server's checksum of name matches the local file, False if it can't checksum
+    # files; the local side is hashed off the event loop so the other sessions keep moving
+    async def checksumsMatch(self, directory, name, localPath):
+        if checksums.checksumCommand(self.pool.features) is None:
+            return False
+        remote = await self.pool.run(lambda ftp: remoteChecksum(ftp, name, self.pool.features), directory)
+        if remote is None:
+            return False
+        local = await asyncio.get_running_loop().run_in_executor(None, checksums.fileChecksum, localPath, remote[0])
+        return local == remote[1]
+
+    # answers for a mirrorSync decision about the remote file name in directory and its local copy
+    def answerer(self, directory, name, localPath):
+        async def answer(question):
+            if question == mirrorSync.MDTM:
+                return await self.pool.run(lambda ftp: mdtmTime(ftp, name), directory)
+            return await self.checksumsMatch(directory, name, localPath)
+        return answer
+
+    # walk the remote tree under root like mirrorSync.crawlRemote, with up to `sessions` listings in
+    # flight; returns ({relative path: ListEntry} for files, set of relative directory paths, failures)
+    async def crawl(self, root):
+        files = {}
+        dirs = set()
+        useMlsd = 'MLST' in self.pool.features
+
+        async def visit(relative, submit):
+            path = posixpath.join(root, relative) if relative else root
+            entries = await self.pool.run(lambda ftp: ftp.listing(useMlsd), path)
+            self.listings.put(path, entries)
+            for entry in entries:
+                child = posixpath.join(relative, entry.name) if relative else entry.name
+                if entry.isDir:
+                    dirs.add(child)
+                    submit(child)
+                else:
+                    files[child] = entry
+
+        failures = await fanOut([''], visit, self.sessions)
+        return files, dirs, failures
+
+    # ----- command handlers -----
+    # each returns the (text, level, delay) status message to show, or None, with ftpEngine's wording
+
+    async def ftp_cd(self, inputs, progress):
+        try:
+            self.remoteDir = await self.pool.run(lambda ftp: self.changeDirectory(ftp, inputs[1]), self.remoteDir)
+        except ftplib.error_perm:
+            return 'Error: invalid directory', 'error', 2000
+        except IndexError:
+            return 'Error: enter a valid directory', 'error', 2000
+        except Exception:
+            return 'Error: unable to change directory', 'error', 2000
+
+    async def changeDirectory(self, ftp, directory):
+        await ftp.cwd(directory)
+        ftp.directory = await ftp.pwd()
+        return ftp.directory
+
+    async def ftp_get(self, inputs, progress):
+        try:
+            algorithm = await self.download(self.remoteDir, inputs[1], inputs[1], progress)
+            return 'File download successful' + verified(algorithm), 'ok', 2000
+        except checksums.ChecksumMismatch:
+            return 'Error: downloaded file does not match the server\'s checksum', 'error', 4000
+        except ftplib.error_perm:
+            return 'Error: failed to download file', 'error', 2000
+        except Exception:
+            return 'Error: unable to download file', 'error', 2000
+
+    async def ftp_put(self, inputs, progress):
+        try:
+            size, algorithm = await self.upload(self.remoteDir, inputs[1], inputs[1], progress)
+            self.listings.update(self.remoteDir, inputs[1], False, size)
+            return 'File "' + inputs[1] + '" upload successful' + verified(algorithm), 'ok', 4000
+        except checksums.ChecksumMismatch:
+            return 'Error: uploaded file does not match the server\'s checksum', 'error', 4000
+        except FileNotFoundError:
+            return 'Error: no such file "' + inputs[1] + '"', 'error', 3000
+        except Exception:
+            return 'Error: unable to upload file', 'error', 2000
+
+    # download a directory tree, skipping files that haven't changed (the same checks as mirrorSync.mirror)
+    async def ftp_mirror(self, inputs, progress):
+        try:
+            remoteRoot = posixpath.normpath(posixpath.join(self.remoteDir, inputs[1]))
+            localRoot = posixpath.basename(remoteRoot) or '.'
+            return mirrorStatus('Mirror', localRoot, await self.mirror(remoteRoot, localRoot, progress))
+        except IndexError:
+            return 'Error: enter a directory to mirror', 'error', 2000
+        except ftplib.error_perm:
+            return 'Error: invalid directory', 'error', 2000
+        except Exception:
+            return 'Error: unable to mirror directory', 'error', 2000
+
+    async def mirror(self, remoteRoot, localRoot, progress):
+        files, dirs, failures = await self.crawl(remoteRoot)
+        if failures and not files and not dirs:
+            raise failures[0][1]
+        os.makedirs(localRoot, exist_ok=True)
+        for relative in dirs:
+            os.makedirs(os.path.join(localRoot, *relative.split('/')), exist_ok=True)
+        counts = {'transferred': 0, 'unchanged': 0}
+
+        async def sync(relative, submit):
+            entry = files[relative]
+            directory = posixpath.dirname(posixpath.join(remoteRoot, relative))
+            localPath = os.path.join(localRoot, *relative.split('/'))
+            unchanged, remoteTime = await decide(mirrorSync.downloadUnchanged(localPath, entry),
+                                                 self.answerer(directory, entry.name, localPath))
+            if unchanged:
+                counts['unchanged'] += 1
+                return
+            await self.download(directory, entry.name, localPath, progress, entry.size)
+            if remoteTime is None:
+                remoteTime = await self.pool.run(lambda ftp: mdtmTime(ftp, entry.name), directory)
+            if remoteTime is not None:
+                os.utime(localPath, (remoteTime, remoteTime))
+            counts['transferred'] += 1
+
+        failures += await fanOut(sorted(files), sync, self.sessions)
+        counts['failed'] = failures
+        return counts
+
+    # upload a local directory tree, skipping files that haven't changed (see mirrorSync.reverseMirror)
+    async def ftp_reverse_mirror(self, inputs, progress):
+        try:
+            localRoot = os.path.normpath(inputs[1])
+            remoteRoot = posixpath.join(self.remoteDir, os.path.basename(os.path.abspath(localRoot)))
+            return mirrorStatus('Reverse mirror', localRoot, await self.reverseMirror(localRoot, remoteRoot, progress))
+        except IndexError:
+            return 'Error: enter a directory to mirror', 'error', 2000
+        except FileNotFoundError:
+            return 'Error: no such directory "' + inputs[1] + '"', 'error', 3000
+        except Exception:
+            return 'Error: unable to mirror directory', 'error', 2000
+
+    async def reverseMirror(self, localRoot, remoteRoot, progress):
+        if not os.path.isdir(localRoot):
+            raise FileNotFoundError(localRoot)
+        try:
+            await self.pool.run(lambda ftp: ftp.pwd(), remoteRoot)            # leasing into it fails if it's missing
+        except ftplib.error_perm:
+            await self.pool.run(lambda ftp: ftp.mkd(remoteRoot))
+            self.listings.update(posixpath.dirname(remoteRoot), posixpath.basename(remoteRoot), True)
+        remoteFiles, remoteDirs, failures = await self.crawl(remoteRoot)
+        localFiles, localDirs = mirrorSync.walkLocal(localRoot)
+
+        # parents sort before their children, so each directory is made after the one it goes in
+        async def makeDirectories(ftp):
+            for relative in sorted(localDirs - remoteDirs):
+                try:
+                    await ftp.mkd(posixpath.join(remoteRoot, relative))
+                except ftplib.error_perm as e:
+                    failures.append((relative, e))
+                    continue
+                self.listings.update(remoteRoot, relative, True)
+
+        await self.pool.run(makeDirectories)
+        counts = {'transferred': 0, 'unchanged': 0}
+        canSetTime = 'MFMT' in self.pool.features
+
+        async def sync(relative, submit):
+            localPath = localFiles[relative]
+            info = os.stat(localPath)
+            directory, name = posixpath.split(posixpath.join(remoteRoot, relative))
+            if await decide(mirrorSync.uploadUnchanged(info, remoteFiles.get(relative)),
+                            self.answerer(directory, name, localPath)):
+                counts['unchanged'] += 1
+                return
+            await self.upload(directory, localPath, name, progress)
+            self.listings.update(directory, name, False, info.st_size)
+            if canSetTime:
+                stamp = time.strftime('%Y%m%d%H%M%S', time.gmtime(info.st_mtime))
+                try:
+                    await self.pool.run(lambda ftp: ftp.sendcmd('MFMT %s %s' % (stamp, name)), directory)
+                except ftplib.error_perm:
+                    pass
+            counts['transferred'] += 1
+
+        failures += await fanOut(sorted(localFiles), sync, self.sessions)
+        counts['failed'] = failures
+        return counts
+
+    async def ftp_mget(self, inputs, progress):
+        try:
+            directory, entries = await self.listing()
+            wanted = set(batchCommands.expandRemote(entries, batchCommands.splitPatterns(inputs[1])))
+            if not wanted:
+                return 'Error: no files match "' + inputs[1] + '"', 'error', 3000
+            done = []
+
+            async def fetch(entry, submit):
+                await self.download(directory, entry.name, entry.name, progress, entry.size)
+                done.append(entry.name)
+
+            failures = await fanOut([entry for entry in entries if entry.name in wanted], fetch, self.sessions)
+            return batchStatus('downloaded', done, failures)
+        except (IndexError, ValueError):
+            return 'Error: enter a file pattern', 'error', 2000
+        except Exception:
+            return 'Error: unable to download files', 'error', 2000
+
+    async def ftp_mput(self, inputs, progress):
+        try:
+            paths = batchCommands.expandLocal(batchCommands.splitPatterns(inputs[1]))
+            if not paths:
+                return 'Error: no local files match "' + inputs[1] + '"', 'error', 3000
+            directory = self.remoteDir
+            done = []
+
+            async def send(path, submit):
+                name = os.path.basename(path)
+                size, _ = await self.upload(directory, path, name, progress)
+                self.listings.update(directory, name, False, size)
+                done.append(name)
+
+            failures = await fanOut(paths, send, self.sessions)
+            return batchStatus('uploaded', done, failures)
+        except (IndexError, ValueError):
+            return 'Error: enter a file pattern', 'error', 2000
+        except Exception:
+            return 'Error: unable to upload files', 'error', 2000
+
+    async def ftp_mdelete(self, inputs, progress):
+        try:
+            directory, entries = await self.listing()
+            names = batchCommands.expandRemote(entries, batchCommands.splitPatterns(inputs[1]))
+            if not names:
+                return 'Error: no files match "' + inputs[1] + '"', 'error', 3000
+            done = []
+
+            async def delete(name, submit):
+                await self.pool.run(lambda ftp: ftp.delete(name), directory)
+                self.listings.remove(directory, name)
+                done.append(name)
+
+            failures = await fanOut(names, delete, self.sessions)
+            return batchStatus('deleted', done, failures)
+        except (IndexError, ValueError):
+            return 'Error: enter a file pattern', 'error', 2000
+        except Exception:
+            return 'Error: unable to delete files', 'error', 2000
+
+    async def ftp_delete(self, inputs, progress):
+        try:
+            await self.pool.run(lambda ftp: ftp.delete(inputs[1]), self.remoteDir)
+            self.listings.remove(self.remoteDir, inputs[1])
+            return 'File "' + inputs[1] + '" deleted', 'ok', 6000
+        except ftplib.error_perm:
+            return 'Error: unable to find file "' + inputs[1] + '"', 'error', 3000
+        except Exception:
+            return 'Error: unable to delete file', 'error', 2000
+
+    async def ftp_rename(self, inputs, progress):
+        try:
+            inputs = inputs[1].split(' > ')
+            await self.pool.run(lambda ftp: ftp.rename(inputs[0], inputs[1]), self.remoteDir)
+            self.listings.rename(self.remoteDir, inputs[0], inputs[1])
+            return 'File name changed from "' + inputs[0] + '" to "' + inputs[1] + '"', 'ok', 4000
+        except ftplib.error_perm:
+            return 'Error: "' + inputs[0] + '" file not found', 'error', 3000
+        except IndexError:
+            return 'Error: invalid file name', 'error', 2000
+        except Exception:
+            return 'Error: name change operation failed', 'error', 2000
+
+    async def ftp_mkdir(self, inputs, progress):
+        try:
+            await self.pool.run(lambda ftp: ftp.mkd(inputs[1]), self.remoteDir)
+            self.listings.update(self.remoteDir, inputs[1], True)
+            return 'Directory "' + inputs[1] + '" successfully created', 'ok', 4000
+        except Exception:
+            return 'Error: unable to create directory', 'error', 2000
+
+    async def ftp_rmdir(self, inputs, progress):
+        try:
+            await self.pool.run(lambda ftp: ftp.rmd(inputs[1]), self.remoteDir)
+            self.listings.remove(self.remoteDir, inputs[1])
+            return 'Directory "' + inputs[1] + '" successfully removed', 'ok', 6000
+        except ftplib.error_perm:
+            return 'Error: directory "' + inputs[1] + '" not found or not empty', 'error', 5000
+        except Exception:
+            return 'Error: unable to remove directory', 'error', 2000
+
+    async def ftp_ls(self, inputs, progress):
+        self.listings.invalidate(self.remoteDir)
+
+    # search the index like ftpEngine.ftp_find; SQLite runs off the event loop so transfers keep moving
+    async def ftp_find(self, inputs, progress):
+        if self.index is None:
+            return 'Error: the remote index is turned off', 'error', 3000
+        try:
+            pattern = inputs[1]
+        except IndexError:
+            return 'Error: enter a name or pattern to find', 'error', 2000
+        try:
+            matches = await asyncio.get_running_loop().run_in_executor(None, self.index.find, pattern, self.remoteDir)
+        except Exception:
+            return 'Error: unable to search the index', 'error', 2000
+        self.shown = self.remoteDir + '   (find "' + pattern + '")', matches
+        if not matches:
+            return 'No indexed files match "' + pattern + '"', 'error', 3000
+        return '%d indexed files match "%s"' % (len(matches), pattern), 'ok', 4000
@@ -0,0 +1,381 @@
+# asyncio implementation of the FTP protocol the client uses: control channel with multi-line
+# replies, FEAT, passive data connections (EPSV, falling back to PASV), LIST/MLSD, RETR/STOR/APPE
+# and REST, MODE Z. Thousands of sessions can share one event loop, where ftplib needs a thread each.
+# Every step has its own timeout (see Timeouts) instead of ftplib's single socket timeout, and
+# errors are raised as the same ftplib exceptions, so the command code handles both engines alike.
+
+import asyncio
+import ftplib
+import time
+import zlib
+
+from connectionPool import dropped, parseFeatures
+from listParser import ListParser
+from transferMetrics import metrics
+
+BLOCKSIZE = 262144
+
+
+# seconds allowed for each kind of step
+class Timeouts:
+
+    def __init__(self, connect=15, command=30, data=15, idle=60):
+        self.connect = connect          # opening the control connection and reading the greeting
+        self.command = command          # one command and its reply
+        self.data = data                # opening a data connection
+        self.idle = idle                # a transfer or listing going this long without a byte
+
+
+def isDropped(error):
+    return isinstance(error, asyncio.TimeoutError) or dropped(error)
+
+
+class AsyncFTP:
+
+    def __init__(self, timeouts=None, encoding='utf-8'):
+        self.timeouts = timeouts or Timeouts()
+        self.encoding = encoding
+        self.reader = None
+        self.writer = None
+        self.host = None
+        self.welcome = None
+        self.directory = None           # remote directory the session is in, None = home (kept by the pool)
+        self.type = None                # current TYPE, so it is only sent when it changes
+        self.mode = 'S'                 # current MODE, likewise; a listing in MODE Z would come back deflated
+        self.hashAlgorithm = None       # what OPTS HASH last set, see checksums.transferAlgorithm
+        self.replyPending = False       # a transfer's final reply hasn't been read yet (see PooledFTP)
+        self.lastUsed = time.monotonic()
+
+    # ----- control channel -----
+
+    async def connect(self, host, port=21):
+        self.host = host
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeouts.connect)
+        self.welcome = await asyncio.wait_for(self.getresp(), self.timeouts.connect)
+        return self.welcome
+
+    async def getline(self):
+        line = await self.reader.readline()
+        if not line:
+            raise EOFError
+        return line.decode(self.encoding, 'replace').rstrip('\r\n')
+
+    # one reply, joining the lines of a multi-line one; raises like ftplib.FTP.getresp
+    async def getresp(self):
+        reply = await self.getline()
+        if reply[3:4] == '-':
+            code = reply[:3]
+            while True:
+                line = await self.getline()
+                reply += '\n' + line
+                if line[:3] == code and line[3:4] != '-':
+                    break
+        self.replyPending = False
+        if reply[:1] in ('1', '2', '3'):
+            return reply
+        if reply[:1] == '4':
+            raise ftplib.error_temp(reply)
+        if reply[:1] == '5':
+            raise ftplib.error_perm(reply)
+        raise ftplib.error_proto(reply)
+
+    async def voidresp(self, timeout=None):
+        reply = await asyncio.wait_for(self.getresp(), timeout or self.timeouts.command)
+        if reply[:1] != '2':
+            raise ftplib.error_reply(reply)
+        return reply
+
+    async def putcmd(self, cmd):
+        self.writer.write((cmd + '\r\n').encode(self.encoding))
+        await self.writer.drain()
+
+    async def sendcmd(self, cmd, timeout=None):
+        started = time.perf_counter()
+        try:
+            await self.putcmd(cmd)
+            return await asyncio.wait_for(self.getresp(), timeout or self.timeouts.command)
+        finally:
+            metrics.controlReply(cmd.split(' ', 1)[0].upper(), time.perf_counter() - started)
+
+    async def voidcmd(self, cmd, timeout=None):
+        reply = await self.sendcmd(cmd, timeout)
+        if reply[:1] != '2':
+            raise ftplib.error_reply(reply)
+        return reply
+
+    async def login(self, user='anonymous', passwd=''):
+        reply = await self.sendcmd('USER ' + user)
+        if reply[:1] == '3':
+            reply = await self.sendcmd('PASS ' + passwd)
+        if reply[:1] != '2':
+            raise ftplib.error_reply(reply)
+        return reply
+
+    # FEAT reply as {'MLST': 'type*;size*;modify*;', 'SIZE': '', ...}, like connectionPool.readFeatures
+    async def features(self):
+        try:
+            return parseFeatures(await self.sendcmd('FEAT'))
+        except ftplib.error_perm:
+            return {}
+
+    async def setType(self, kind):
+        if self.type != kind:
+            await self.voidcmd('TYPE ' + kind)
+            self.type = kind
+
+    async def transferMode(self, mode):
+        if self.mode != mode:
+            await self.voidcmd('MODE ' + mode)
+            self.mode = mode
+
+    async def pwd(self):
+        return ftplib.parse257(await self.voidcmd('PWD'))
+
+    async def cwd(self, directory):
+        return await self.voidcmd('CWD ' + directory)
+
+    async def size(self, name):
+        reply = await self.sendcmd('SIZE ' + name)
+        if reply[:3] != '213':
+            raise ftplib.error_reply(reply)
+        return int(reply[3:].strip())
+
+    async def mkd(self, name):
+        return await self.voidcmd('MKD ' + name)
+
+    async def rmd(self, name):
+        return await self.voidcmd('RMD ' + name)
+
+    async def delete(self, name):
+        return await self.voidcmd('DELE ' + name)
+
+    async def rename(self, oldName, newName):
+        reply = await self.sendcmd('RNFR ' + oldName)
+        if reply[:1] != '3':
+            raise ftplib.error_reply(reply)
+        return await self.voidcmd('RNTO ' + newName)
+
+    async def quit(self):
+        try:
+            await self.voidcmd('QUIT', self.timeouts.connect)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    # ----- data connections -----
+
+    # open a passive data connection and send cmd on it; returns (reader, writer) once the server
+    # has answered 1xx, like ftplib's transfercmd
+    async def transfercmd(self, cmd, rest=None):
+        started = time.perf_counter()
+        try:
+            host, port = ftplib.parse229(await self.sendcmd('EPSV'), (self.host, 0))
+        except ftplib.error_perm:
+            host, port = ftplib.parse227(await self.sendcmd('PASV'))
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeouts.data)
+        try:
+            if rest is not None:
+                await self.sendcmd('REST %d' % rest)
+            reply = await self.sendcmd(cmd, self.timeouts.data)
+            if reply[:1] == '2':                # some servers send a 200 before the 150, as ftplib notes
+                reply = await asyncio.wait_for(self.getresp(), self.timeouts.data)
+            if reply[:1] != '1':
+                raise ftplib.error_reply(reply)
+        except BaseException:
+            writer.close()
+            raise
+        self.replyPending = True
+        metrics.dataConnection(time.perf_counter() - started)
+        return reader, writer
+
+    # read off the reply to a transfer that failed on our side (not a dropped connection), so the
+    # session can be reused; if that fails too, replyPending stays set and the pool throws it away
+    async def discardReply(self, error):
+        if isinstance(error, Exception) and not isDropped(error):
+            try:
+                await self.voidresp(self.timeouts.idle)
+            except (ftplib.Error, OSError, EOFError, asyncio.TimeoutError):
+                pass
+
+    # read a data connection to the end, handing each block to received(block)
+    async def readData(self, reader, received):
+        while True:
+            block = await asyncio.wait_for(reader.read(BLOCKSIZE), self.timeouts.idle)
+            if not block:
+                return
+            received(block)
+
+    # directory listing of the current directory as ListEntry records (MLSD if useMlsd, else LIST)
+    async def listing(self, useMlsd):
+        parser = ListParser()
+        pending = [b'']
+
+        def received(block):
+            lines = (pending[0] + block).split(b'\n')
+            pending[0] = lines.pop()
+            for line in lines:
+                parser.feed(line.decode(self.encoding, 'replace').rstrip('\r'))
+
+        await self.setType('A')
+        await self.transferMode('S')
+        reader, writer = await self.transfercmd('MLSD' if useMlsd else 'LIST')
+        try:
+            await self.readData(reader, received)
+        finally:
+            writer.close()
+        if pending[0]:
+            parser.feed(pending[0].decode(self.encoding, 'replace').rstrip('\r'))
+        await self.voidresp(self.timeouts.idle)
+        return parser.entries
+
+    # RETR-style cmd into the file openFile() returns, which is only called once the server has
+    # accepted cmd (the caller closes it); progress(nbytes) is called for every block and may raise to abort.
+    # digest, if given, is updated with the file's bytes on the way; compress=True transfers in MODE Z
+    async def retrieve(self, cmd, openFile, rest=None, progress=None, digest=None, compress=False):
+        await self.setType('I')
+        await self.transferMode('Z' if compress else 'S')
+        inflater = zlib.decompressobj() if compress else None
+        reader, writer = await self.transfercmd(cmd, rest)
+
+        def write(block):
+            localFile.write(block)
+            if digest:
+                digest.update(block)
+            if progress:
+                progress(len(block))
+
+        def received(block):
+            write(inflater.decompress(block) if inflater else block)
+
+        try:
+            try:
+                localFile = openFile()
+                await self.readData(reader, received)
+                if inflater:
+                    write(inflater.flush())
+            finally:
+                writer.close()
+        except BaseException as e:
+            await self.discardReply(e)
+            raise
+        return await self.voidresp(self.timeouts.idle)
+
+    # STOR/APPE-style cmd sending localFile from its current position; accepted(), if given, is
+    # called once the server has accepted cmd. digest and compress as for retrieve
+    async def store(self, cmd, localFile, rest=None, progress=None, accepted=None, digest=None, compress=False):
+        await self.setType('I')
+        await self.transferMode('Z' if compress else 'S')
+        deflater = zlib.compressobj() if compress else None
+        reader, writer = await self.transfercmd(cmd, rest)
+        try:
+            try:
+                if accepted:
+                    accepted()
+                for block in iter(lambda: localFile.read(BLOCKSIZE), b''):
+                    if digest:
+                        digest.update(block)
+                    writer.write(deflater.compress(block) if deflater else block)
+                    await asyncio.wait_for(writer.drain(), self.timeouts.idle)
+                    if progress:
+                        progress(len(block))
+                if deflater:
+                    writer.write(deflater.flush())
+                    await asyncio.wait_for(writer.drain(), self.timeouts.idle)
+                if writer.can_write_eof():
+                    writer.write_eof()
+            finally:
+                writer.close()
+        except BaseException as e:
+            await self.discardReply(e)
+            raise
+        return await self.voidresp(self.timeouts.idle)
+
+
+# asyncio counterpart of ConnectionPool: at most `size` logged-in sessions, leased one operation at a
+# time and positioned in the directory asked for. Dropped or timed-out sessions, and ones that still
+# owe a transfer's reply, are thrown away
+class AsyncPool:
+
+    def __init__(self, connect, size=16):
+        self.connect = connect                  # coroutine function returning a new logged-in AsyncFTP
+        self.size = size
+        self.features = None
+        self.idle = []
+        self.count = 0
+        self.closed = False
+        self.cond = asyncio.Condition()
+
+    async def add(self, session):
+        if self.features is None:
+            self.features = await session.features()
+        async with self.cond:
+            self.count += 1
+            self.idle.append(session)
+            self.cond.notify()
+
+    async def acquire(self):
+        async with self.cond:
+            while True:
+                if self.closed:
+                    raise ftplib.error_temp('421 Connection pool closed')
+                if self.idle:
+                    return self.idle.pop()
+                if self.count < self.size:
+                    self.count += 1
+                    break
+                await self.cond.wait()
+        try:
+            session = await self.connect()
+            if self.features is None:
+                self.features = await session.features()
+            return session
+        except BaseException:
+            async with self.cond:
+                self.count -= 1
+                self.cond.notify()
+            raise
+
+    async def release(self, session, broken=False):
+        session.lastUsed = time.monotonic()
+        async with self.cond:
+            if not broken and not self.closed:
+                self.idle.append(session)
+                self.cond.notify()
+                return
+            self.count -= 1
+            self.cond.notify()
+        session.close()
+
+    # run func(session) (a coroutine function) on a session in directory, retrying once on a fresh
+    # login if the session turns out to have been dropped
+    async def run(self, func, directory=None):
+        for attempt in (1, 2):
+            session = await self.acquire()
+            try:
+                if directory and session.directory != directory:
+                    await session.cwd(directory)
+                    session.directory = directory
+                result = await func(session)
+            except BaseException as e:
+                broken = not isinstance(e, Exception) or isDropped(e) or session.replyPending  # cancelled mid-reply too
+                await self.release(session, broken)
+                if attempt == 2 or not isinstance(e, Exception) or not isDropped(e):
+                    raise
+                continue
+            await self.release(session, session.replyPending)
+            return result
+
+    async def close(self):
+        async with self.cond:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.cond.notify_all()
+        for session in idle:
+            try:
+                await session.quit()
+            except Exception:
+                session.close()
@@ -0,0 +1,96 @@
+# Batch versions of get/put/delete for glob patterns (mget, mput, mdelete). Remote patterns are
+# matched against the cached listing and local ones against the filesystem, then the whole batch
+# runs as one job: downloads and uploads are spread over several pooled sessions, and DELEs are
+# pipelined on one session, sent in windows without waiting for each reply.
+
+import fnmatch
+import ftplib
+import glob
+import os
+import shlex
+import threading
+
+import resumableTransfer
+from transferQueue import FileProgress, runBounded
+
+WORKERS = 4                             # transfers in flight at once
+PIPELINE_DEPTH = 32                     # commands sent ahead of their replies
+
+
+# 'a*.log "my file.txt"' -> ['a*.log', 'my file.txt']
+def splitPatterns(text):
+    return shlex.split(text)
+
+
+# names of the files in a listing matching any of the patterns, in listing order
+def expandRemote(entries, patterns):
+    return [entry.name for entry in entries
+            if not entry.isDir and any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in patterns)]
+
+
+# local files matching any of the patterns, in pattern then name order; resume sidecars are left out
+def expandLocal(patterns):
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if path not in seen and not resumableTransfer.isStateFile(path) and os.path.isfile(path):
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def readReply(ftp):
+    try:
+        return ftp.voidresp()
+    except (ftplib.error_perm, ftplib.error_temp, ftplib.error_reply) as e:
+        return e
+
+
+# send a window of commands back to back, then collect their replies (or errors) in order. The
+# server still runs them one at a time; we just pay one round trip per window instead of per command
+def pipeline(ftp, commands):
+    for command in commands:
+        ftp.putcmd(command)
+    return [readReply(ftp) for command in commands]
+
+
+# delete names in directory, PIPELINE_DEPTH DELEs per round trip; returns (deleted names, [(name, error)])
+def deleteMany(pool, directory, names, job):
+    deleted = []
+    failures = []
+    with pool.lease(directory) as ftp:
+        for start in range(0, len(names), PIPELINE_DEPTH):
+            window = names[start:start + PIPELINE_DEPTH]
+            for name, reply in zip(window, pipeline(ftp, ['DELE ' + name for name in window])):
+                if isinstance(reply, Exception):
+                    failures.append((name, reply))
+                else:
+                    deleted.append(name)
+            job.checkpoint()                                # between windows, so no replies are left unread
+    return deleted, failures
+
+
+# download names from directory into the local working directory; returns (done, failures)
+def getMany(pool, directory, names, job, workers=WORKERS):
+    done = []
+    lock = threading.Lock()
+
+    def fetch(name, submit):
+        resumableTransfer.download(lambda: pool.lease(directory), name, name, FileProgress(job, lock))
+        done.append(name)
+
+    return done, runBounded(names, fetch, workers)
+
+
+# upload local paths into directory under their base names; returns ([(name, size)], failures)
+def putMany(pool, directory, paths, job, workers=WORKERS):
+    done = []
+    lock = threading.Lock()
+
+    def send(path, submit):
+        name = os.path.basename(path)
+        resumableTransfer.upload(lambda: pool.lease(directory), path, name, FileProgress(job, lock))
+        done.append((name, os.path.getsize(path)))
+
+    return done, runBounded(paths, send, workers)
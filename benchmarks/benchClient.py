@@ -0,0 +1,256 @@
+# End-to-end benchmark for the client's command engine (ftpEngine.py) against benchmarks/localServer.py
+# on loopback. Scenarios:
+#
+#   get      one large file downloaded with get, --repeat times
+#   put      the same file uploaded with put
+#   small    --files small files fetched one get at a time (round trip bound)
+#   mget     the same files fetched with one mget
+#   list     ls of a --entries entry directory (listing fetch + parse)
+#   cd       cd into a directory and back, each followed by the listing the window would print
+#
+# Each scenario runs in its own process so its peak RSS is its own, and reports throughput, latency
+# percentiles (per command) and peak RSS. The server can add latency to every control reply and cap
+# the bandwidth of every data connection. --save keeps the results as a baseline and --baseline
+# compares a run against one, exiting 1 if anything got worse by more than --tolerance percent.
+#
+#   python benchmarks/benchClient.py [--scenario all|get|put|small|mget|list|cd] [--size-mb 64]
+#                                    [--files 2000] [--entries 100000] [--cycles 200] [--repeat 3]
+#                                    [--latency 0.02] [--bandwidth 10000000] [--save FILE] [--baseline FILE]
+#                                    [--compress] [--no-verify]
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from transferMetrics import percentile
+
+SCENARIOS = ['get', 'put', 'small', 'mget', 'list', 'cd']
+HIGHER_IS_BETTER = ('mbPerSecond', 'opsPerSecond')
+LOWER_IS_BETTER = ('p50Ms', 'p95Ms', 'p99Ms', 'peakRssMb')
+
+
+# ----- fixtures -----
+
+def makeFixtures(root, local, args):
+    os.makedirs(os.path.join(root, 'small'))
+    os.makedirs(os.path.join(root, 'big'))
+    os.makedirs(os.path.join(root, 'sub'))
+    block = os.urandom(1048576)
+    with open(os.path.join(local, 'large.bin'), 'wb') as localFile:
+        for _ in range(args.size_mb):
+            localFile.write(block)
+    shutil.copy(os.path.join(local, 'large.bin'), os.path.join(root, 'large.bin'))
+    for i in range(args.files):
+        with open(os.path.join(root, 'small', 'file%05d.txt' % i), 'wb') as smallFile:
+            smallFile.write(block[i % 1024:i % 1024 + 4096])
+    for i in range(args.entries):
+        open(os.path.join(root, 'big', 'entry%06d.dat' % i), 'wb').close()
+
+
+# ----- child process: one scenario against the running server -----
+
+def runScenario(name, args):
+    import ftpEngine
+    from transferQueue import Job
+
+    pool = ftpEngine.start('127.0.0.1', 'bench', 'bench', port=args.port, indexPath=os.path.join(args.local, 'index.sqlite'),
+                           compress=args.compress, verify=args.verify)
+    os.chdir(args.local)
+    jobIds = iter(range(1, 1 << 30))
+
+    def command(text, listing=False):
+        inputs = text.split(' ', 1)
+        handler = ftpEngine.commandHandlers[inputs[0]]
+        job = Job(next(jobIds), text, handler, inputs, None, True)
+        started = time.perf_counter()
+        status = ftpEngine.runCommand(job, handler, inputs)[0] if listing else ftpEngine.execute(job, handler, inputs)
+        if status and status[1] != 'ok':
+            raise RuntimeError(text + ': ' + status[0])
+        return time.perf_counter() - started, job.done
+
+    latencies = []
+    nbytes = 0
+    ops = 0
+    started = time.perf_counter()
+    with pool:
+        if name == 'get':
+            for _ in range(args.repeat):
+                if os.path.exists('large.bin'):
+                    os.remove('large.bin')                  # otherwise get would find it complete and skip it
+                seconds, done = command('get large.bin')
+                latencies.append(seconds)
+                nbytes += done
+                ops += 1
+        elif name == 'put':
+            for _ in range(args.repeat):
+                seconds, done = command('put large.bin')
+                latencies.append(seconds)
+                nbytes += done
+                ops += 1
+        elif name == 'small':
+            command('cd small')
+            os.makedirs('small', exist_ok=True)
+            os.chdir('small')
+            for i in range(args.files):
+                seconds, done = command('get file%05d.txt' % i)
+                latencies.append(seconds)
+                nbytes += done
+                ops += 1
+        elif name == 'mget':
+            command('cd small')
+            os.makedirs('mget', exist_ok=True)
+            os.chdir('mget')
+            seconds, done = command('mget *')
+            latencies.append(seconds)
+            nbytes += done
+            ops += args.files
+        elif name == 'list':
+            command('cd big')
+            for _ in range(args.repeat):
+                seconds, done = command('ls', listing=True)
+                latencies.append(seconds)
+                ops += args.entries
+        elif name == 'cd':
+            for _ in range(args.cycles):
+                for text in ('cd sub', 'cd ..'):
+                    seconds, done = command(text, listing=True)
+                    latencies.append(seconds)
+                    ops += 1
+    elapsed = time.perf_counter() - started
+    return summarise(latencies, nbytes, ops, elapsed)
+
+
+def peakRssMb():
+    try:
+        import resource
+    except ImportError:                                     # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1048576 if sys.platform == 'darwin' else 1024), 1)       # bytes on macOS, kB elsewhere
+
+
+def summarise(latencies, nbytes, ops, elapsed):
+    ordered = sorted(latencies)
+    result = {'seconds': round(elapsed, 3), 'ops': ops, 'opsPerSecond': round(ops / elapsed, 1),
+              'p50Ms': round(percentile(ordered, 50) * 1000, 2), 'p95Ms': round(percentile(ordered, 95) * 1000, 2),
+              'p99Ms': round(percentile(ordered, 99) * 1000, 2), 'peakRssMb': peakRssMb()}
+    if nbytes:
+        result['mbPerSecond'] = round(nbytes / 1048576 / elapsed, 1)
+    return result
+
+
+# ----- parent process -----
+
+def startServer(root, args):
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'localServer.py'), root, '--latency', str(args.latency),
+                               '--bandwidth', str(args.bandwidth)], stdout=subprocess.PIPE, text=True)
+    return server, int(server.stdout.readline())
+
+
+def runChild(name, port, local, args):
+    argv = [sys.executable, os.path.abspath(__file__), '--child', name, '--port', str(port), '--local', local,
+            '--files', str(args.files), '--entries', str(args.entries), '--cycles', str(args.cycles), '--repeat', str(args.repeat)]
+    argv += ['--compress'] if args.compress else []
+    argv += [] if args.verify else ['--no-verify']
+    output = subprocess.run(argv, stdout=subprocess.PIPE, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def show(name, result):
+    rate = '%8.1f MB/s' % result['mbPerSecond'] if 'mbPerSecond' in result else ' ' * 13
+    rss = '-' if result['peakRssMb'] is None else '%.1f MB' % result['peakRssMb']
+    print('%-6s %s %11.1f ops/s   p50 %8.2f ms   p95 %8.2f ms   p99 %8.2f ms   peak RSS %s' % (
+        name, rate, result['opsPerSecond'], result['p50Ms'], result['p95Ms'], result['p99Ms'], rss))
+
+
+# print the change in every metric against the baseline; returns the names of the ones that regressed
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            if not before.get(key) or result.get(key) is None:
+                continue
+            change = (result[key] - before[key]) * 100.0 / before[key]
+            worse = -change if key in HIGHER_IS_BETTER else change
+            changes.append('%s %+.1f%%' % (key, change))
+            if worse > tolerance:
+                regressions.append(name + ' ' + key)
+        print('%-6s vs baseline: %s' % (name, ', '.join(changes)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the FTP client against a local server')
+    parser.add_argument('--scenario', choices=SCENARIOS + ['all'], default='all')
+    parser.add_argument('--size-mb', type=int, default=64, help='size of the get/put file (default 64)')
+    parser.add_argument('--files', type=int, default=2000, help='small files for small/mget (default 2000)')
+    parser.add_argument('--entries', type=int, default=100000, help='entries in the listed directory (default 100000)')
+    parser.add_argument('--cycles', type=int, default=200, help='cd round trips (default 200)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of the get/put/list scenarios (default 3)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the server waits before each reply')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes/sec cap per data connection, 0 = none')
+    parser.add_argument('--compress', action='store_true', help='deflate transfers with MODE Z')
+    parser.add_argument('--no-verify', dest='verify', action='store_false', help='skip the checksum check after get/put')
+    parser.add_argument('--save', metavar='FILE', help='store the results as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='percent a metric may get worse (default 10)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--local', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(runScenario(args.child, args)))
+        return 0
+
+    workspace = tempfile.mkdtemp(prefix='ftpbench-')
+    root = os.path.join(workspace, 'server')
+    local = os.path.join(workspace, 'local')
+    os.makedirs(root)
+    os.makedirs(local)
+    server = None
+    try:
+        makeFixtures(root, local, args)
+        server, port = startServer(root, args)
+        settings = {key: getattr(args, key) for key in ('size_mb', 'files', 'entries', 'cycles', 'repeat', 'latency', 'bandwidth',
+                                                        'compress', 'verify')}
+        print('latency %.3f s, bandwidth %s' % (args.latency, '%d B/s' % args.bandwidth if args.bandwidth else 'unlimited'))
+        results = {}
+        for name in (SCENARIOS if args.scenario == 'all' else [args.scenario]):
+            results[name] = runChild(name, port, local, args)
+            show(name, results[name])
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as baselineFile:
+            json.dump({'settings': settings, 'results': results}, baselineFile, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        if baseline.get('settings') != settings:
+            print('warning: baseline was recorded with different settings: %s' % baseline.get('settings'))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('regressed: ' + ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# Benchmark for listParser: parses a synthetic directory listing (1M lines by default) in each
+# format and reports lines per second and peak memory. Lines are generated on the fly so the
+# memory figure is the parser and its entries, not the input.
+#
+#   python benchmarks/benchListParser.py [--lines 1000000] [--format unix|dos|mlsd|all]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from listParser import ListParser
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+# a mix of files, directories, symlinks and names with repeated spaces, like a real big directory
+def unixLines(count):
+    for i in range(count):
+        month = MONTHS[i % 12]
+        if i % 50 == 0:
+            yield 'drwxr-xr-x    2 owner    group        4096 %s %2d  2016 folder %d' % (month, i % 28 + 1, i)
+        elif i % 97 == 0:
+            yield 'lrwxrwxrwx    1 owner    group          11 %s %2d 10:30 link%d -> target/%d' % (month, i % 28 + 1, i, i)
+        else:
+            yield '-rw-r--r--    1 owner    group    %8d %s %2d 09:%02d log  file %d.txt' % (i * 37 % 10000000, month, i % 28 + 1, i % 60, i)
+
+
+def dosLines(count):
+    for i in range(count):
+        if i % 50 == 0:
+            yield '%02d-%02d-16  09:30AM       <DIR>          folder %d' % (i % 12 + 1, i % 28 + 1, i)
+        else:
+            yield '%02d-%02d-16  09:30PM       %14d log  file %d.txt' % (i % 12 + 1, i % 28 + 1, i * 37 % 10000000, i)
+
+
+def mlsdLines(count):
+    for i in range(count):
+        if i % 50 == 0:
+            yield 'type=dir;modify=2016%02d%02d093000; folder %d' % (i % 12 + 1, i % 28 + 1, i)
+        else:
+            yield 'type=file;size=%d;modify=2016%02d%02d093000; log  file %d.txt' % (i * 37 % 10000000, i % 12 + 1, i % 28 + 1, i)
+
+
+generators = {'unix': unixLines, 'dos': dosLines, 'mlsd': mlsdLines}
+
+
+def parseAll(lines):
+    parser = ListParser()
+    feed = parser.feed
+    for line in lines:
+        feed(line)
+    return parser
+
+
+def bench(name, count):
+    # generating the lines costs time too, so measure it on its own and take it off
+    started = time.perf_counter()
+    for _ in generators[name](count):
+        pass
+    generateTime = time.perf_counter() - started
+
+    started = time.perf_counter()
+    parser = parseAll(generators[name](count))
+    parseTime = time.perf_counter() - started - generateTime
+    parsed = len(parser.entries)
+    del parser
+
+    tracemalloc.start()                                     # second pass just for memory, tracing slows parsing down
+    parser = parseAll(generators[name](count))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('%-5s %9d lines  %6.2f s  %10.0f lines/s  peak %7.1f MB  (%d bytes/entry)  skipped %d' % (
+        name, count, parseTime, count / max(parseTime, 1e-9), peak / 1048576, peak // max(parsed, 1), parser.skipped))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the directory listing parser')
+    parser.add_argument('--lines', type=int, default=1000000, help='lines per listing (default 1000000)')
+    parser.add_argument('--format', choices=['unix', 'dos', 'mlsd', 'all'], default='all')
+    args = parser.parse_args()
+    for name in (generators if args.format == 'all' else [args.format]):
+        bench(name, args.lines)
+
+
+if __name__ == '__main__':
+    main()
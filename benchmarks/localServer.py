@@ -0,0 +1,349 @@
+# Minimal threaded FTP server for running the client against a local directory on loopback.
+# Covers the parts of RFC 959 / RFC 3659 the client uses (PASV/EPSV, LIST/MLSD/NLST, RETR/STOR/APPE,
+# REST, SIZE, MDTM, FEAT) plus HASH, XCRC, XMD5 and MODE Z, and can inject artificial
+# latency on every control reply and a bandwidth cap on every data connection. Used by the benchmarks:
+#
+#   python benchmarks/localServer.py ROOT [--port 0] [--latency 0.02] [--bandwidth 1000000]
+#
+# serves ROOT on loopback (any user name and password) and prints the port it listens on.
+
+import argparse
+import hashlib
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+import zlib
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+FEATURES = ['EPSV', 'MDTM', 'MLST type*;size*;modify*;', 'MODE Z', 'REST STREAM', 'SIZE', 'UTF8',
+            'HASH SHA-256*;SHA-1;MD5;CRC32', 'XCRC', 'XMD5']
+
+
+class FtpHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)     # no Nagle stall between replies
+        self.cwd = '/'
+        self.rest = 0
+        self.mode = 'S'
+        self.hashName = 'SHA-256'
+        self.renameFrom = None
+        self.dataListener = None
+
+    def reply(self, text):
+        if self.server.latency:
+            time.sleep(self.server.latency)                                 # simulated round-trip delay
+        self.wfile.write((text + '\r\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        self.reply('220 localServer ready')
+        for line in self.rfile:
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            command, _, arg = line.partition(' ')
+            handler = getattr(self, 'ftp_' + command.upper(), None)
+            if handler is None:
+                self.reply('502 Command not implemented')
+                continue
+            try:
+                if handler(arg) is False:
+                    break
+            except (ConnectionError, socket.timeout):
+                self.reply('426 Connection closed; transfer aborted')
+            except OSError as e:
+                self.reply('550 ' + (e.strerror or str(e)))
+        if self.dataListener:
+            self.dataListener.close()
+
+    # map a client path onto the served directory without letting it escape the root
+    def virtualPath(self, arg):
+        return os.path.normpath(os.path.join(self.cwd, arg or '.')).replace('\\', '/').replace('//', '/')
+
+    def realPath(self, arg):
+        return os.path.join(self.server.root, self.virtualPath(arg).lstrip('/'))
+
+    # ----- data connections -----
+
+    def openListener(self):
+        if self.dataListener:
+            self.dataListener.close()
+        self.dataListener = socket.socket()
+        self.dataListener.bind((self.server.server_address[0], 0))
+        self.dataListener.listen(1)
+        self.dataListener.settimeout(10)
+        return self.dataListener.getsockname()[1]
+
+    def acceptData(self):
+        if self.dataListener is None:
+            self.reply('425 Use PASV or EPSV first')
+            return None
+        self.reply('150 Opening data connection')
+        conn, _ = self.dataListener.accept()
+        self.dataListener.close()
+        self.dataListener = None
+        return conn
+
+    def sendData(self, conn, chunks):
+        compressor = zlib.compressobj() if self.mode == 'Z' else None
+        limit = self.server.bandwidth
+        started = time.perf_counter()
+        sent = 0
+        with conn:
+            for chunk in chunks:
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                conn.sendall(chunk)
+                sent += len(chunk)
+                if limit:                                                   # sleep until we are back under the cap
+                    ahead = sent / limit - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            if compressor:
+                conn.sendall(compressor.flush())
+
+    def recvData(self, conn, localFile):
+        decompressor = zlib.decompressobj() if self.mode == 'Z' else None
+        limit = self.server.bandwidth
+        started = time.perf_counter()
+        received = 0
+        with conn:
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                received += len(chunk)
+                localFile.write(decompressor.decompress(chunk) if decompressor else chunk)
+                if limit:
+                    ahead = received / limit - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            if decompressor:
+                localFile.write(decompressor.flush())
+
+    def ftp_PASV(self, arg):
+        port = self.openListener()
+        host = self.server.server_address[0].replace('.', ',')
+        self.reply('227 Entering Passive Mode (%s,%d,%d)' % (host, port >> 8, port & 0xFF))
+
+    def ftp_EPSV(self, arg):
+        self.reply('229 Entering Extended Passive Mode (|||%d|)' % self.openListener())
+
+    # ----- session -----
+
+    def ftp_USER(self, arg):
+        self.reply('331 Password required')
+
+    def ftp_PASS(self, arg):
+        self.reply('230 Logged in')
+
+    def ftp_QUIT(self, arg):
+        self.reply('221 Goodbye')
+        return False
+
+    def ftp_NOOP(self, arg):
+        self.reply('200 NOOP ok')
+
+    def ftp_SYST(self, arg):
+        self.reply('215 UNIX Type: L8')
+
+    def ftp_FEAT(self, arg):
+        self.wfile.write(('211-Features:\r\n' + ''.join(' %s\r\n' % f for f in FEATURES)).encode('utf-8'))
+        self.reply('211 End')
+
+    def ftp_OPTS(self, arg):
+        option, _, value = arg.partition(' ')
+        if option.upper() == 'HASH' and value.upper() in ('SHA-256', 'SHA-1', 'MD5', 'CRC32'):
+            self.hashName = value.upper()
+            self.reply('200 ' + self.hashName)
+        else:
+            self.reply('200 OK')
+
+    def ftp_TYPE(self, arg):
+        self.reply('200 Type set to ' + arg)
+
+    def ftp_MODE(self, arg):
+        if arg.upper() not in ('S', 'Z'):
+            self.reply('504 Mode not supported')
+            return
+        self.mode = arg.upper()
+        self.reply('200 Mode set to ' + self.mode)
+
+    def ftp_REST(self, arg):
+        self.rest = int(arg)
+        self.reply('350 Restarting at %d' % self.rest)
+
+    def ftp_ABOR(self, arg):
+        self.reply('226 Abort successful')
+
+    # ----- navigation -----
+
+    def ftp_PWD(self, arg):
+        self.reply('257 "%s" is the current directory' % self.cwd)
+
+    def ftp_CWD(self, arg):
+        if not os.path.isdir(self.realPath(arg)):
+            self.reply('550 No such directory')
+            return
+        self.cwd = self.virtualPath(arg)
+        self.reply('250 Directory changed to ' + self.cwd)
+
+    def ftp_CDUP(self, arg):
+        self.ftp_CWD('..')
+
+    def ftp_MKD(self, arg):
+        os.mkdir(self.realPath(arg))
+        self.reply('257 "%s" created' % self.virtualPath(arg))
+
+    def ftp_RMD(self, arg):
+        os.rmdir(self.realPath(arg))
+        self.reply('250 Directory removed')
+
+    def ftp_DELE(self, arg):
+        os.remove(self.realPath(arg))
+        self.reply('250 File deleted')
+
+    def ftp_RNFR(self, arg):
+        if not os.path.exists(self.realPath(arg)):
+            self.reply('550 No such file')
+            return
+        self.renameFrom = self.realPath(arg)
+        self.reply('350 Ready for RNTO')
+
+    def ftp_RNTO(self, arg):
+        os.rename(self.renameFrom, self.realPath(arg))
+        self.renameFrom = None
+        self.reply('250 Rename successful')
+
+    def ftp_SIZE(self, arg):
+        self.reply('213 %d' % os.path.getsize(self.realPath(arg)))
+
+    def ftp_MDTM(self, arg):
+        self.reply('213 ' + time.strftime('%Y%m%d%H%M%S', time.gmtime(os.path.getmtime(self.realPath(arg)))))
+
+    # ----- listings -----
+
+    def listEntries(self, arg):
+        path = self.realPath(arg)
+        if os.path.isfile(path):
+            return [(os.path.basename(path), os.stat(path))]
+        return [(name, os.stat(os.path.join(path, name))) for name in sorted(os.listdir(path))]
+
+    def unixLine(self, name, info):
+        modified = time.gmtime(info.st_mtime)
+        if time.time() - info.st_mtime < 180 * 86400:
+            stamp = '%s %2d %02d:%02d' % (MONTHS[modified.tm_mon - 1], modified.tm_mday, modified.tm_hour, modified.tm_min)
+        else:
+            stamp = '%s %2d  %d' % (MONTHS[modified.tm_mon - 1], modified.tm_mday, modified.tm_year)
+        return '%s 1 owner group %12d %s %s\r\n' % (stat.filemode(info.st_mode), info.st_size, stamp, name)
+
+    def mlsdLine(self, name, info):
+        kind = 'dir' if stat.S_ISDIR(info.st_mode) else 'file'
+        modify = time.strftime('%Y%m%d%H%M%S', time.gmtime(info.st_mtime))
+        return 'type=%s;size=%d;modify=%s; %s\r\n' % (kind, info.st_size, modify, name)
+
+    def sendListing(self, arg, formatLine):
+        entries = self.listEntries(arg.lstrip('-al ') if arg.startswith('-') else arg)
+        conn = self.acceptData()
+        if conn:
+            self.sendData(conn, (formatLine(name, info).encode('utf-8') for name, info in entries))
+            self.reply('226 Transfer complete')
+
+    def ftp_LIST(self, arg):
+        self.sendListing(arg, self.unixLine)
+
+    def ftp_MLSD(self, arg):
+        self.sendListing(arg, self.mlsdLine)
+
+    def ftp_NLST(self, arg):
+        self.sendListing(arg, lambda name, info: name + '\r\n')
+
+    # ----- transfers -----
+
+    def ftp_RETR(self, arg):
+        with open(self.realPath(arg), 'rb') as localFile:
+            localFile.seek(self.rest)
+            self.rest = 0
+            conn = self.acceptData()
+            if conn:
+                self.sendData(conn, iter(lambda: localFile.read(65536), b''))
+                self.reply('226 Transfer complete')
+
+    def storeFile(self, arg, fileMode):
+        with open(self.realPath(arg), fileMode) as localFile:
+            if self.rest:
+                localFile.seek(self.rest)
+                localFile.truncate()
+            self.rest = 0
+            conn = self.acceptData()
+            if conn:
+                self.recvData(conn, localFile)
+                self.reply('226 Transfer complete')
+
+    def ftp_STOR(self, arg):
+        self.storeFile(arg, 'r+b' if self.rest and os.path.exists(self.realPath(arg)) else 'wb')
+
+    def ftp_APPE(self, arg):
+        self.storeFile(arg, 'ab')
+
+    # ----- checksums -----
+
+    def fileDigest(self, path, name):
+        if name == 'CRC32':
+            crc = 0
+            with open(path, 'rb') as localFile:
+                for chunk in iter(lambda: localFile.read(1 << 20), b''):
+                    crc = zlib.crc32(chunk, crc)
+            return '%08x' % crc
+        digest = hashlib.new(name.replace('-', '').lower())
+        with open(path, 'rb') as localFile:
+            for chunk in iter(lambda: localFile.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def ftp_HASH(self, arg):
+        path = self.realPath(arg)
+        size = os.path.getsize(path)
+        self.reply('213 %s 0-%d %s %s' % (self.hashName, size, self.fileDigest(path, self.hashName), arg))
+
+    def ftp_XCRC(self, arg):
+        self.reply('250 ' + self.fileDigest(self.realPath(arg), 'CRC32').upper())
+
+    def ftp_XMD5(self, arg):
+        self.reply('251 ' + self.fileDigest(self.realPath(arg), 'MD5').upper())
+
+
+class LocalServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128                                                # the async engine opens dozens of sessions at once
+
+    def __init__(self, root, host='127.0.0.1', port=0, latency=0.0, bandwidth=0):
+        super().__init__((host, port), FtpHandler)
+        self.root = os.path.abspath(root)
+        self.latency = latency                                              # seconds added before every reply
+        self.bandwidth = bandwidth                                          # bytes/sec per data connection, 0 = unlimited
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a directory over FTP on loopback.')
+    parser.add_argument('root')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added before every control reply')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes/sec cap per data connection, 0 = none')
+    args = parser.parse_args()
+    server = LocalServer(args.root, args.host, args.port, args.latency, args.bandwidth)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
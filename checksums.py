@@ -0,0 +1,144 @@
+# Checksums for checking a local file against the server's copy without transferring it. The server
+# side uses HASH (draft-bryan-ftpext-hash) when FEAT advertises it, otherwise XCRC or XMD5.
+# Transfers verify themselves the same way: the digest is fed each block as it crosses the data
+# connection (see dataPath) and compared with the server's answer once the transfer is done.
+
+import ftplib
+import hashlib
+import zlib
+
+# HASH algorithm names -> hashlib names
+HASH_NAMES = {'SHA-256': 'sha256', 'SHA-512': 'sha512', 'SHA-1': 'sha1', 'MD5': 'md5', 'CRC32': 'crc32'}
+
+
+# zlib.crc32 behind the same update()/hexdigest() interface as hashlib
+class Crc32:
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return '%08x' % self.value
+
+
+def newDigest(algorithm):
+    name = HASH_NAMES[algorithm]
+    return Crc32() if name == 'crc32' else hashlib.new(name)
+
+
+def fileChecksum(path, algorithm):
+    digest = newDigest(algorithm)
+    with open(path, 'rb') as localFile:
+        for chunk in iter(lambda: localFile.read(1048576), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# feed digest the first `length` bytes of an open file, e.g. the part a resumed transfer won't send
+def updateFromFile(digest, localFile, length):
+    localFile.seek(0)
+    while length > 0:
+        chunk = localFile.read(min(length, 1048576))
+        if not chunk:
+            break
+        digest.update(chunk)
+        length -= len(chunk)
+
+
+# cheapest first: verifying a transfer only has to catch corruption on the way, and CRC32 keeps up
+# with the data connection where SHA-256 wouldn't on a fast link
+CHEAPEST = ['CRC32', 'MD5', 'SHA-1', 'SHA-256', 'SHA-512']
+
+
+# (algorithm to verify a transfer with, algorithm the session's checksums come in now) for a session
+# whose HASH was last set to current (None if never); (None, None) if the server can't checksum files.
+# When the two differ the session needs an OPTS HASH first, see transferAlgorithm
+def chooseAlgorithm(features, current=None):
+    if 'HASH' in features:
+        offered = [name.strip().rstrip('*').upper() for name in features['HASH'].split(';')]
+        for algorithm in CHEAPEST:
+            if algorithm in offered:
+                break
+        else:
+            return None, None
+        if current is None:                     # the one FEAT marks with *, until we pick another
+            starred = [name.strip()[:-1].upper() for name in features['HASH'].split(';') if name.strip().endswith('*')]
+            current = starred[0] if starred else None
+        return algorithm, current
+    if 'XCRC' in features:
+        return 'CRC32', 'CRC32'
+    if 'XMD5' in features:
+        return 'MD5', 'MD5'
+    return None, None
+
+
+# the algorithm to verify a transfer with, or None if the server can't checksum files. With HASH the
+# cheapest one offered is selected for the session (OPTS HASH) so remoteChecksum answers in it
+def transferAlgorithm(ftp, features):
+    algorithm, current = chooseAlgorithm(features, getattr(ftp, 'hashAlgorithm', None))
+    if algorithm == current:
+        return algorithm
+    try:
+        ftp.sendcmd('OPTS HASH ' + algorithm)
+    except ftplib.error_perm:
+        return current if current in HASH_NAMES else None
+    ftp.hashAlgorithm = algorithm
+    return algorithm
+
+
+class ChecksumMismatch(ftplib.error_temp):      # temporary, so the transfer is retried from scratch
+    pass
+
+
+# compare a transfer's streamed digest with the server's checksum of the file; raises ChecksumMismatch
+# if they differ. Returns False if the server gave no usable answer, True if they match
+def verify(ftp, remotePath, features, algorithm, digest):
+    return compareDigest(remotePath, algorithm, digest, remoteChecksum(ftp, remotePath, features))
+
+
+# the same given the server's (algorithm, digest) answer, or None if it gave none
+def compareDigest(remotePath, algorithm, digest, remote):
+    if remote is None or remote[0] != algorithm:
+        return False
+    if remote[1] != digest.hexdigest():
+        raise ChecksumMismatch('451 %s of %s is %s on the server, %s here' % (algorithm, remotePath, remote[1], digest.hexdigest()))
+    return True
+
+
+# (algorithm, lowercase hex digest) of a remote file, or None if the server can't tell us
+def remoteChecksum(ftp, remotePath, features):
+    command = checksumCommand(features)
+    if command is None:
+        return None
+    try:
+        return parseChecksum(command, ftp.sendcmd(command + ' ' + remotePath))
+    except ftplib.error_perm:
+        return None
+
+
+# the command that asks the server for a file's checksum, None if it has none
+def checksumCommand(features):
+    for command in ('HASH', 'XCRC', 'XMD5'):
+        if command in features:
+            return command
+    return None
+
+
+# (algorithm, lowercase hex digest) from the reply to checksumCommand, None if it can't be read
+def parseChecksum(command, reply):
+    try:
+        if command == 'HASH':
+            algorithm, _, digest = reply.split(None, 4)[1:4]                # 213 SHA-256 0-49 <hex> name
+            algorithm = algorithm.upper()
+        else:
+            algorithm, digest = 'CRC32' if command == 'XCRC' else 'MD5', reply.split()[-1]
+        if algorithm == 'CRC32':
+            digest = '%08x' % int(digest, 16)               # some servers drop leading zeros
+    except ValueError:
+        return None
+    if algorithm not in HASH_NAMES:
+        return None
+    return algorithm, digest.lower()
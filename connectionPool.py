@@ -0,0 +1,202 @@
+# Pool of logged-in FTP sessions shared by the transfer workers. Operations lease a session, use it
+# and hand it back, so several commands can talk to the server at once without each one logging in.
+# Idle sessions are health-checked with NOOP, and sessions the server has dropped (421 timeouts,
+# closed sockets) are thrown away and replaced with a fresh login the next time one is needed.
+
+import contextlib
+import ftplib
+import socket
+import threading
+import time
+
+
+# did this error come from the server closing the session rather than from the command itself?
+def dropped(error):
+    if isinstance(error, (EOFError, ConnectionError, socket.timeout)):
+        return True
+    return isinstance(error, ftplib.error_temp) and str(error).startswith('421')
+
+
+# ftplib.FTP that knows whether the final reply of a transfer is still owed, i.e. transfercmd has
+# returned but nobody has read the 226/426 yet. The pool only hands out sessions that owe nothing,
+# since the next command on one that does would be answered with the transfer's reply
+class PooledFTP(ftplib.FTP):
+
+    replyPending = False
+
+    def ntransfercmd(self, cmd, rest=None):
+        result = super().ntransfercmd(cmd, rest)
+        self.replyPending = True
+        return result
+
+    def getresp(self):
+        try:
+            reply = super().getresp()
+        except ftplib.Error:                    # an error reply has been read all the same
+            self.replyPending = False
+            raise
+        self.replyPending = False
+        return reply
+
+
+# FEAT reply as {'MLST': 'type*;size*;modify*;', 'SIZE': '', ...}; empty if the server has no FEAT
+def readFeatures(session):
+    try:
+        return parseFeatures(session.sendcmd('FEAT'))
+    except ftplib.error_perm:
+        return {}
+
+
+# the same from the reply text, for asyncFtp too
+def parseFeatures(reply):
+    features = {}
+    for line in reply.splitlines()[1:-1]:
+        name, _, params = line.strip().partition(' ')
+        features[name.upper()] = params
+    return features
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, session=None, size=4, idleCheck=30):
+        self.connect = connect                  # returns a new logged-in ftplib.FTP
+        self.size = size                        # most sessions open at once, leased or idle
+        self.idleCheck = idleCheck              # seconds a session may sit idle before it gets a NOOP
+        self.features = None                    # FEAT reply of the first session, same for every login
+        self.idle = []
+        self.count = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        if session:
+            self.add(session)
+        threading.Thread(target=self.keepAlive, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # adopt a session that is already logged in, e.g. the one used to validate the login
+    def add(self, session):
+        self.prepare(session)
+        with self.cond:
+            self.count += 1
+            self.idle.append(session)
+            self.cond.notify()
+
+    def prepare(self, session):
+        if self.features is None:
+            self.features = readFeatures(session)
+        session.directory = None                # remote directory the session is in, None = home
+        session.features = self.features        # so the data path can see MODE Z without the pool
+        session.lastUsed = time.monotonic()
+        return session
+
+    def alive(self, session):
+        try:
+            session.voidcmd('NOOP')
+            return True
+        except ftplib.all_errors:
+            return False
+
+    def discard(self, session):
+        try:
+            session.close()
+        except Exception:
+            pass
+        with self.cond:
+            self.count -= 1
+            self.cond.notify()
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise ftplib.error_temp('421 Connection pool closed')
+                if self.idle:
+                    session = self.idle.pop()   # most recently used first, so spare sessions can age out
+                    break
+                if self.count < self.size:
+                    self.count += 1
+                    session = None
+                    break
+                self.cond.wait()
+        if session is not None:
+            if time.monotonic() - session.lastUsed < self.idleCheck or self.alive(session):
+                return session
+            session.close()                     # server dropped it while idle: log in again in its place
+        try:
+            return self.prepare(self.connect())
+        except BaseException:
+            with self.cond:
+                self.count -= 1
+                self.cond.notify()
+            raise
+
+    def release(self, session):
+        session.lastUsed = time.monotonic()
+        with self.cond:
+            if not self.closed:
+                self.idle.append(session)
+                self.cond.notify()
+                return
+        self.discard(session)
+
+    # lease a session positioned in directory; it is replaced rather than reused if the server drops
+    # it or if it still owes the reply to a transfer that was cut short
+    @contextlib.contextmanager
+    def lease(self, directory=None):
+        session = self.acquire()
+        try:
+            if directory and session.directory != directory:
+                session.cwd(directory)
+                session.directory = directory
+            yield session
+        except BaseException as e:
+            if (isinstance(e, Exception) and dropped(e)) or getattr(session, 'replyPending', False):
+                self.discard(session)
+            else:
+                self.release(session)
+            raise
+        if getattr(session, 'replyPending', False):
+            self.discard(session)
+        else:
+            self.release(session)
+
+    # run func(session) on a leased session, retrying once on a fresh login if the session was dropped
+    def run(self, func, directory=None):
+        try:
+            with self.lease(directory) as session:
+                return func(session)
+        except Exception as e:
+            if not dropped(e):
+                raise
+        with self.lease(directory) as session:
+            return func(session)
+
+    # NOOP idle sessions in the background so they don't time out, dropping any that already have
+    def keepAlive(self):
+        while not self.closed:
+            time.sleep(self.idleCheck)
+            now = time.monotonic()
+            with self.cond:
+                stale = [session for session in self.idle if now - session.lastUsed >= self.idleCheck]
+                self.idle = [session for session in self.idle if session not in stale]
+            for session in stale:
+                if self.alive(session):
+                    self.release(session)
+                else:
+                    self.discard(session)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.cond.notify_all()
+        for session in idle:
+            try:
+                session.quit()
+            except Exception:
+                pass
+            self.discard(session)
@@ -0,0 +1,184 @@
+# Fast data connection loops for RETR/STOR, used instead of ftplib's retrbinary/storbinary (8 kB
+# blocks, a fresh bytes object per block). Downloads recv_into one reusable buffer per thread and
+# uploads go through socket.sendfile, so the kernel copies file pages straight to the socket.
+# Block and socket buffer sizes follow the bandwidth-delay product measured on earlier transfers.
+# Both loops can also feed a checksum as the blocks go by and, when the server offers MODE Z,
+# deflate the stream; either one sends uploads through a buffer instead of sendfile.
+
+import os
+import socket
+import sys
+import threading
+import time
+import zlib
+
+MIN_BLOCK = 65536
+MAX_BLOCK = 4 * 1048576
+DEFAULT_BLOCK = 262144                  # until we have measured the link
+MAX_SOCKET_BUFFER = 16 * 1048576
+MIN_SAMPLE = 1048576                    # transfers smaller than this say little about bandwidth
+SMOOTHING = 0.25                        # weight of each new measurement
+
+compress = False                        # use MODE Z where the server has it; set by ftpEngine.start
+verify = True                           # check transfers against the server's HASH/XCRC/XMD5
+
+# Linux grows socket buffers on its own up to tcp_rmem/tcp_wmem, and setting SO_RCVBUF/SO_SNDBUF
+# switches that off (capped at rmem_max/wmem_max), so we only size them by hand elsewhere
+AUTOTUNED = sys.platform.startswith('linux')
+
+
+def smooth(old, new):
+    return new if old is None else old + SMOOTHING * (new - old)
+
+
+# running estimate of the control round trip time and per-connection throughput to the server
+class LinkEstimate:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rtt = None                 # seconds
+        self.bandwidth = None           # bytes/sec of one data connection
+
+    def observeRtt(self, seconds):
+        with self.lock:
+            self.rtt = smooth(self.rtt, seconds)
+
+    def observeTransfer(self, nbytes, seconds):
+        if nbytes >= MIN_SAMPLE and seconds > 0:
+            with self.lock:
+                self.bandwidth = smooth(self.bandwidth, nbytes / seconds)
+
+    # bandwidth-delay product in bytes, None until both halves have been measured
+    def bdp(self):
+        with self.lock:
+            if self.rtt is None or self.bandwidth is None:
+                return None
+            return self.rtt * self.bandwidth
+
+    # power of two near the BDP, so one recv/sendfile call moves about a round trip's worth of data
+    def blocksize(self):
+        bdp = self.bdp()
+        if bdp is None:
+            return DEFAULT_BLOCK
+        block = MIN_BLOCK
+        while block < bdp and block < MAX_BLOCK:
+            block *= 2
+        return block
+
+    def socketBuffer(self):
+        bdp = self.bdp()
+        return None if bdp is None else min(int(2 * bdp), MAX_SOCKET_BUFFER)
+
+
+link = LinkEstimate()
+buffers = threading.local()
+
+
+# this thread's transfer buffer, reallocated only when the block size changes
+def blockBuffer(size):
+    view = getattr(buffers, 'view', None)
+    if view is None or len(view) != size:
+        view = buffers.view = memoryview(bytearray(size))
+    return view
+
+
+# TYPE I, timed to keep the round trip estimate current
+def binaryMode(ftp):
+    started = time.perf_counter()
+    ftp.voidcmd('TYPE I')
+    link.observeRtt(time.perf_counter() - started)
+
+
+# MODE S or Z, sent only when it changes. Sessions remember theirs, since a listing on a session
+# left in MODE Z would come back deflated
+def transferMode(ftp, mode):
+    if getattr(ftp, 'mode', 'S') != mode:
+        ftp.voidcmd('MODE ' + mode)
+        ftp.mode = mode
+
+
+# whether a transfer from offset should be deflated; REST offsets are only defined for MODE S
+def compressing(ftp, offset=0):
+    return compress and not offset and offersModeZ(getattr(ftp, 'features', {}))
+
+
+def offersModeZ(features):
+    return 'Z' in features.get('MODE', '').upper().split()
+
+
+def tuneSocket(conn, option):
+    size = link.socketBuffer()
+    if AUTOTUNED or size is None:
+        return
+    try:
+        if conn.getsockopt(socket.SOL_SOCKET, option) < size:
+            conn.setsockopt(socket.SOL_SOCKET, option, size)
+    except OSError:
+        pass                            # the OS refused the size; keep its default
+
+
+# RETR-style command into the file returned by openFile(), which is only called once the server has
+# accepted the command; the caller closes it. received(nbytes) is called after every block is
+# written and may raise to abort. digest, if given, is updated with the file's bytes on the way.
+# Returns the final reply like retrbinary
+def retrieve(ftp, cmd, openFile, received, rest=None, digest=None):
+    inflater = zlib.decompressobj() if compressing(ftp, rest) else None
+    transferMode(ftp, 'Z' if inflater else 'S')
+    view = blockBuffer(link.blocksize())
+    total = 0
+    with ftp.transfercmd(cmd, rest) as conn:
+        localFile = openFile()
+        tuneSocket(conn, socket.SO_RCVBUF)
+        started = time.perf_counter()
+        while True:
+            count = conn.recv_into(view)
+            if not count:
+                break
+            total += count
+            block = inflater.decompress(view[:count]) if inflater else view[:count]
+            localFile.write(block)
+            if digest:
+                digest.update(block)
+            received(len(block))
+        if inflater:
+            block = inflater.flush()
+            localFile.write(block)
+            if digest:
+                digest.update(block)
+            received(len(block))
+        link.observeTransfer(total, time.perf_counter() - started)
+    return ftp.voidresp()
+
+
+# STOR/APPE-style command sending localFile from its current position; sent(nbytes) is called after
+# every block and may raise to abort. accepted(), if given, is called once the server has accepted
+# the command. digest, if given, is updated with the bytes sent. Returns the final reply like storbinary
+def store(ftp, cmd, localFile, sent, rest=None, digest=None, accepted=None):
+    deflater = zlib.compressobj() if compressing(ftp, rest or localFile.tell()) else None
+    transferMode(ftp, 'Z' if deflater else 'S')
+    blocksize = link.blocksize()
+    position = localFile.tell()
+    total = 0
+    with ftp.transfercmd(cmd, rest) as conn:
+        if accepted:
+            accepted()
+        tuneSocket(conn, socket.SO_SNDBUF)
+        started = time.perf_counter()
+        while True:
+            if hasattr(os, 'sendfile') and not deflater and not digest:
+                count = conn.sendfile(localFile, position, blocksize)
+            else:                                           # socket.sendfile would fall back to 8 kB sends
+                view = blockBuffer(blocksize)
+                count = localFile.readinto(view)
+                if digest:
+                    digest.update(view[:count])
+                conn.sendall(deflater.compress(view[:count]) if deflater else view[:count])
+            if not count:
+                break
+            position += count
+            total += count
+            sent(count)
+        if deflater:
+            conn.sendall(deflater.flush())
+        link.observeTransfer(total, time.perf_counter() - started)
+    return ftp.voidresp()
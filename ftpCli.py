@@ -0,0 +1,209 @@
+# Headless scripting mode: log in, run client commands through the same engine as the Tk window
+# (ftpEngine.py) and print one JSON object per command on stdout, so cron jobs and CI pipelines can
+# drive the client without a display. Commands are the ones typed in the window's command box.
+#
+#   python ftpCli.py ftp.example.com -u user -c "cd pub; mget *.txt"
+#   python ftpCli.py ftp.example.com -u user nightly.txt            (one command per line, # comments)
+#   echo ls | python ftpCli.py ftp.example.com                      (commands from stdin)
+#
+# --engine async runs the commands on asyncio instead, with batch commands fanned out over
+# --sessions connections from one thread (every command but op and pget, which need the threaded engine).
+# find searches the remote index (see remoteIndex.py) that every listing is saved to; --crawl fills
+# it in the background while the script runs, as the window does (threaded engine only).
+# --metrics FILE saves control round trip times, data connection setup times and per-command rates.
+# The password comes from -p or the FTP_PASSWORD environment variable (which keeps it out of ps).
+# Exit status: 0 every command succeeded, 1 a command failed, 2 login failed, 3 bad arguments.
+
+import argparse
+import asyncio
+import ftplib
+import json
+import os
+import sys
+import time
+
+import ftpEngine
+from asyncEngine import AsyncEngine
+from asyncFtp import Timeouts
+from remoteIndex import INDEX_PATH, openIndex
+from transferMetrics import metrics
+from transferQueue import Job
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_LOGIN = 2
+EXIT_USAGE = 3
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description='Run FTP client commands without the window.')
+    parser.add_argument('host')
+    parser.add_argument('script', nargs='?', help='file of commands, one per line (default: stdin)')
+    parser.add_argument('--port', type=int, default=21)
+    parser.add_argument('-u', '--user', default='anonymous')
+    parser.add_argument('-p', '--password', default=os.environ.get('FTP_PASSWORD', ''))
+    parser.add_argument('-c', '--commands', help='commands separated by ";" instead of a script')
+    parser.add_argument('-k', '--keep-going', action='store_true', help='carry on after a failed command')
+    parser.add_argument('--metrics', metavar='FILE', help='save round trip times and rates to FILE (.json or .csv)')
+    parser.add_argument('--index', metavar='FILE', default=INDEX_PATH, help='remote index used by find, op and get (default %(default)s)')
+    parser.add_argument('--no-index', dest='index', action='store_const', const=None, help='don\'t keep a remote index')
+    parser.add_argument('--crawl', action='store_true', help='index the remote tree in the background while the commands run')
+    parser.add_argument('--compress', action='store_true', help='deflate transfers (MODE Z) if the server supports it')
+    parser.add_argument('--no-verify', dest='verify', action='store_false',
+                        help='don\'t check transfers against the server\'s HASH/XCRC/XMD5')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads',
+                        help='async runs on asyncio and spreads mget/mput/mdelete/mirror over --sessions connections')
+    parser.add_argument('--sessions', type=int, default=16, help='connections for the async engine (default 16)')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds per command/idle transfer for the async engine')
+    return parser.parse_args(argv)
+
+
+def readCommands(args):
+    if args.commands is not None:
+        lines = args.commands.split(';')
+    elif args.script and args.script != '-':
+        with open(args.script) as scriptFile:
+            lines = scriptFile.read().splitlines()
+    else:
+        lines = sys.stdin.read().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+
+def emit(record):
+    sys.stdout.write(json.dumps(record) + '\n')
+    sys.stdout.flush()
+
+
+def makeRecord(command, status, seconds, directory, nbytes=0, stalled=0.0, entries=None):
+    record = {'command': command, 'ok': status is None or status[1] == 'ok', 'message': status[0] if status else '',
+              'directory': directory, 'seconds': round(seconds, 3)}
+    if nbytes:
+        record.update(bytes=nbytes, bytesPerSecond=round(nbytes / seconds) if seconds else None, stalled=round(stalled, 3))
+    if entries is not None:
+        record['entries'] = [{'name': entry.name, 'dir': entry.isDir, 'size': entry.size, 'modified': entry.modified}
+                             for entry in entries]
+    return record
+
+
+# record for a successful login, mentioning an index that couldn't be opened
+def loginRecord(directory, indexError):
+    message = 'logged in' if indexError is None else 'logged in; remote index off: ' + indexError
+    return {'command': 'login', 'ok': True, 'message': message, 'directory': directory}
+
+
+# run one command on this thread; returns its JSON record
+def runCommand(jobId, command):
+    inputs = command.split(' ', 1)
+    handler = ftpEngine.commandHandlers.get(inputs[0])
+    if handler is None:
+        return makeRecord(command, ('Error: unknown command "' + inputs[0] + '"', 'error', 0), 0, ftpEngine.remoteDir)
+    job = Job(jobId, command, handler, inputs, None, True)
+    started = time.monotonic()
+    entries = None
+    try:
+        status = ftpEngine.execute(job, handler, inputs)
+        if job.listing:
+            entries = job.listing[1]
+        elif inputs[0] == 'ls':
+            directory, entries = ftpEngine.ftp_list()
+    except Exception as e:                                      # handlers catch their own errors; this is a dropped listing
+        status = 'Error: ' + str(e), 'error', 0
+    return makeRecord(command, status, time.monotonic() - started, ftpEngine.remoteDir, job.moved, job.stalled, entries)
+
+
+# the same through the asyncio engine, which spreads batch commands over --sessions connections
+async def runAsyncCommand(engine, command):
+    moved = [0]
+    started = time.monotonic()
+    entries = None
+    try:
+        status = await engine.execute(command, lambda nbytes: moved.__setitem__(0, moved[0] + nbytes))
+        if engine.shown:
+            entries = engine.shown[1]
+        elif command.split(' ', 1)[0] == 'ls':
+            directory, entries = await engine.listing()
+    except Exception as e:
+        status = 'Error: ' + (str(e) or 'timed out'), 'error', 0
+    return makeRecord(command, status, time.monotonic() - started, engine.remoteDir, moved[0], entries=entries)
+
+
+# run the commands in order, emitting a record for each; returns the exit status
+def runScript(args, commands):
+    try:
+        pool = ftpEngine.start(args.host, args.user, args.password, port=args.port, indexPath=args.index, crawl=args.crawl,
+                               compress=args.compress, verify=args.verify)
+    except (ftplib.Error, OSError, EOFError) as e:
+        emit({'command': 'login', 'ok': False, 'message': str(e)})
+        return EXIT_LOGIN
+    emit(loginRecord(ftpEngine.remoteDir, ftpEngine.indexError))
+
+    status = EXIT_OK
+    with pool:
+        for jobId, command in enumerate(commands, 1):
+            record = runCommand(jobId, command)
+            emit(record)
+            if not record['ok']:
+                status = EXIT_FAILED
+                if not args.keep_going:
+                    break
+    return status
+
+
+async def runScriptAsync(args, commands):
+    index, indexError = openIndex(ftpEngine.indexSite(args.user, args.host, args.port), args.index) if args.index else (None, None)
+    engine = AsyncEngine(args.host, args.user, args.password, port=args.port, sessions=args.sessions,
+                         timeouts=Timeouts(command=args.timeout, data=args.timeout, idle=args.timeout), index=index,
+                         compress=args.compress, verify=args.verify)
+    try:
+        await engine.start()
+    except (ftplib.Error, OSError, EOFError, asyncio.TimeoutError) as e:
+        emit({'command': 'login', 'ok': False, 'message': str(e) or 'timed out'})
+        await engine.close()
+        return EXIT_LOGIN
+    emit(loginRecord(engine.remoteDir, indexError))
+
+    status = EXIT_OK
+    try:
+        for command in commands:
+            record = await runAsyncCommand(engine, command)
+            emit(record)
+            if not record['ok']:
+                status = EXIT_FAILED
+                if not args.keep_going:
+                    break
+    finally:
+        await engine.close()
+    return status
+
+
+def main(argv=None):
+    try:
+        args = parseArguments(argv)
+        commands = readCommands(args)
+    except OSError as e:
+        emit({'command': 'script', 'ok': False, 'message': str(e)})
+        return EXIT_USAGE
+    except SystemExit as e:                                     # argparse has already printed the usage
+        return EXIT_USAGE if e.code else EXIT_OK
+    if args.engine == 'async' and args.crawl:
+        emit({'command': 'arguments', 'ok': False, 'message': '--crawl needs --engine threads'})
+        return EXIT_USAGE
+
+    if args.engine == 'async':
+        status = asyncio.run(runScriptAsync(args, commands))
+    else:
+        status = runScript(args, commands)
+    if args.metrics:
+        try:
+            metrics.export(args.metrics)
+        except OSError as e:
+            emit({'command': 'metrics', 'ok': False, 'message': str(e)})
+            status = status or EXIT_FAILED
+    return status
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -6,7 +6,12 @@ from tkinter import *               # importing all UI features necessary for cr
 from tkinter import messagebox 
 import ftplib                       # contains the FTP functions used
 from socket import gaierror         # for catching invalid ftp address error
-import os                           # for opening files after downloading them
+from transferQueue import TransferQueue                   # runs commands off the Tk main thread
+import ftpEngine                                          # command handlers, pooled sessions, listing cache
+from transferMetrics import MeteredFTP, metrics           # round trip/setup timings and per-command rates
+from listParser import formatSize                         # sizes shown with B/kB/MB/GB units
+from listView import ListView                             # draws only the visible part of the listing
+import dataPath                                           # compress/verify switches for transfers
 
 
 # ============================================================================
@@ -27,12 +32,13 @@ def loginCheck(event):
     global site_address
     global site_username
     global site_password
+    global loginSession
     site_address = loginFTP.get()
     site_username = loginUsername.get()
     site_password = loginPassword.get()
     try:                                                                 # checking if login credentials are valid
-        ftplib.FTP(site_address)
-        ftplib.FTP(site_address).login(site_username, site_password)
+        loginSession = MeteredFTP(site_address, timeout=1000)
+        loginSession.login(site_username, site_password)                 # validated session is kept for the client window
         loginWindow.destroy()                                            # if login is successful, destroy login window
     except TimeoutError:                                                 # error handling
         statusBar.config(text='Error:  Connection attempt timed out', fg='red')
@@ -105,11 +111,9 @@ loginWindow.mainloop()
 # ask for confirmation before exiting
 def closeWindow():
     if messagebox.askokcancel('Exit', 'Exit program?'):
-        try:
-            ftp.quit()
-            root.destroy()
-        except Exception:               # simply destroy root to end program incase ftp.quit() is timed out and causes error
-            root.destroy()
+        transfers.shutdown()            # cancel queued/running jobs so the workers hand back their sessions
+        pool.close()                    # quits idle sessions, leased ones are closed as they come back
+        root.destroy()
 
 # displaying commands list in new centered window when "?" help button is pressed
 def helpDisplay():
@@ -123,12 +127,30 @@ def helpDisplay():
     Label(helpFrame, text='cd [dir]          :   access directory').pack(anchor=W)
     Label(helpFrame, text='cd ..               :   move up 1 directory').pack(anchor=W)
     Label(helpFrame, text='get [file]        :   download file').pack(anchor=W)
+    Label(helpFrame, text='pget [file]      :   download file over several connections').pack(anchor=W)
     Label(helpFrame, text='put [file]        :   upload file').pack(anchor=W)
+    Label(helpFrame, text='mget [pattern]  :   download matching files, e.g. mget *.log').pack(anchor=W)
+    Label(helpFrame, text='mput [pattern]  :   upload matching local files').pack(anchor=W)
+    Label(helpFrame, text='mdelete [pattern]   :   delete matching files').pack(anchor=W)
+    Label(helpFrame, text='mirror [dir]      :   download directory tree, only what changed').pack(anchor=W)
+    Label(helpFrame, text='reverse-mirror [dir]   :   upload local directory tree, only what changed').pack(anchor=W)
     Label(helpFrame, text='rename [fileOld > fileNew]   :   change file name using >').pack(anchor=W)
     Label(helpFrame, text='mkdir [dir]    :   create new directory').pack(anchor=W)
     Label(helpFrame, text='rmdir [dir]     :   remove directory').pack(anchor=W)
     Label(helpFrame, text='delete [file]   :   delete file').pack(anchor=W)
     Label(helpFrame, text='op [file]         :   download then open file').pack(anchor=W)
+    Label(helpFrame, text='ls                    :   list current directory again').pack(anchor=W)
+    Label(helpFrame, text='find [pattern]   :   search every directory below this one, e.g. find *.iso').pack(anchor=W)
+    Label(helpFrame, text='sort [name|size|date]   :   sort listing (or click a column title)').pack(anchor=W)
+    Label(helpFrame, text='jobs                :   list queued and running jobs').pack(anchor=W)
+    Label(helpFrame, text='cancel [id]     :   cancel job (all jobs if no id)').pack(anchor=W)
+    Label(helpFrame, text='pause [id]       :   pause job (all jobs if no id)').pack(anchor=W)
+    Label(helpFrame, text='resume [id]    :   resume paused job (all jobs if no id)').pack(anchor=W)
+    Label(helpFrame, text='metrics            :   show transfer rates and server round trip times').pack(anchor=W)
+    Label(helpFrame, text='metrics export [file.json|file.csv]   :   save the metrics').pack(anchor=W)
+    Label(helpFrame, text='metrics reset   :   clear the metrics').pack(anchor=W)
+    Label(helpFrame, text='compress [on|off]   :   deflate transfers if the server supports MODE Z').pack(anchor=W)
+    Label(helpFrame, text='verify [on|off]   :   check get/put against the server\'s checksum').pack(anchor=W)
     Label(helpFrame, text='exit                 :   close program').pack(anchor=W)
     helpWindow.update()
     help_width = helpWindow.winfo_width()
@@ -147,203 +169,202 @@ def getEntry(event):
     else:
         ftp_command(userCommand)        # pass entry to ftp_command for execution
 
-# takes in command from entry box and executes accordingly
+# show a command result in the status bar, then revert to "Ready" after delay ms
+def showStatus(text, fg, delay):
+    global progressShown
+    progressShown = False
+    statusBar.config(text=text, fg=fg)
+    statusBar.after(delay, backToReady)
+
+# takes in command from entry box and queues it for execution on a worker thread
 def ftp_command(input):
     inputs = input.split(' ', 1)        # split first word of user input to compare with if/elif statements to decide action
 
     # ----- Commands -----
     # cd - open directory (cd .. to move up a directory)
     # get - download file
+    # pget - download file in parallel segments over several connections
     # put - upload file
+    # mget/mput/mdelete - get/put/delete every file matching glob patterns (quote names with spaces)
+    # mirror - download a remote directory tree into a local directory of the same name
+    # reverse-mirror - upload a local directory tree into a remote directory of the same name
     # delete - delete file
     # rename - rename file
     # mkdir - create a new directory
     # rmdir - remove a directory
     # op - open file (if not on local machine, download first then open)
+    # ls - fetch the current directory listing again instead of using the cached one
+    # find - search the index of the remote tree below the current directory (glob pattern or part of a name)
+    # sort - sort the listing by name, size or date (again to reverse)
+    # jobs - list queued and running jobs
+    # cancel/pause/resume - control a job by id (all jobs if no id given)
+    # metrics - live transfer/latency panel (metrics export [file] / metrics reset)
+    # compress on|off - deflate later transfers (MODE Z) when the server supports it
+    # verify on|off - check later get/put against the server's checksum (on by default)
     # exit - close ftp client
 
-    try:                                # exception for catching FTP timeout error
-        if inputs[0] == 'cd':           # change directory
-            try:
-                ftp.cwd(inputs[1])
-            except ftplib.error_perm:
-                statusBar.config(text='Error: invalid directory', fg='red')
-                statusBar.after(2000, backToReady)
-            except IndexError:
-                statusBar.config(text='Error: enter a valid directory', fg='red')
-                statusBar.after(2000, backToReady)
-            except Exception:
-                statusBar.config(text='Error: unable to change directory', fg='red')
-                statusBar.after(2000, backToReady)
-            ftp_print()
-        
-        elif inputs[0] == 'get':        # download file
-            try:
-                ftp.retrbinary('RETR ' + inputs[1], open(inputs[1], 'wb').write)
-                statusBar.config(text='File download successful', fg='green')
-                statusBar.after(2000, backToReady)
-            except ftplib.error_perm:
-                statusBar.config(text='Error: failed to download file', fg='red')
-                statusBar.after(2000, backToReady)
-            except Exception:
-                statusBar.config(text='Error: unable to download file', fg='red')
-                statusBar.after(2000, backToReady)
-            ftp_print()
-
-        elif inputs[0] == 'put':        # upload file
-            try:
-                ftp.storbinary('STOR ' + inputs[1], open(inputs[1], 'rb'))
-                statusBar.config(text='File "' + inputs[1] + '" upload successful', fg='green')
-                statusBar.after(4000, backToReady)
-            except FileNotFoundError:
-                statusBar.config(text='Error: no such file "' + inputs[1] + '"', fg='red')
-                statusBar.after(3000, backToReady)
-            except Exception:
-                statusBar.config(text='Error: unable to upload file', fg='red')
-                statusBar.after(2000, backToReady)
-            ftp_print()
-
-        elif inputs[0] == 'delete':     # delete file
-            try:
-                ftp.delete(inputs[1])
-                statusBar.config(text='File "' + inputs[1] + '" deleted', fg='green')
-                statusBar.after(6000, backToReady)
-            except ftplib.error_perm:
-                statusBar.config(text='Error: unable to find file "' + inputs[1] + '"', fg='red')
-                statusBar.after(3000, backToReady)
-            except Exception:
-                statusBar.config(text='Error: unable to delete file', fg='red')
-                statusBar.after(2000, backToReady)
-            ftp_print()
-        
-        elif inputs[0] == 'rename':     # rename file
-            inputs = inputs[1].split(' > ')
-            try:
-                ftp.rename(inputs[0], inputs[1])
-                statusBar.config(text='File name changed from "' + inputs[0] + '" to "' + inputs[1] + '"', fg='green')
-                statusBar.after(4000, backToReady)
-            except ftplib.error_perm:
-                statusBar.config(text='Error: "' + inputs[0] + '" file not found', fg='red')
-                statusBar.after(3000, backToReady)
-            except IndexError:
-                statusBar.config(text='Error: invalid file name', fg='red')
-                statusBar.after(2000, backToReady)
-            except Exception:
-                statusBar.config(text='Error: name change operation failed', fg='red')
-                statusBar.after(2000, backToReady)
-            ftp_print()
-        
-        elif inputs[0] == 'mkdir':      # create a new directory
-            try:
-                ftp.mkd(inputs[1])
-                statusBar.config(text='Directory "' + inputs[1] + '" successfully created', fg='green')
-                statusBar.after(4000, backToReady)
-            except Exception:
-                statusBar.config(text='Error: unable to create directory', fg='red')
-                statusBar.after(2000, backToReady)
-            ftp_print()
-
-        elif inputs[0] == 'rmdir':      # delete a directory
-            try:
-                ftp.rmd(inputs[1])
-                statusBar.config(text='Directory "' + inputs[1] + '" successfully removed', fg='green')
-                statusBar.after(6000, backToReady)
-            except ftplib.error_perm:
-                statusBar.config(text='Error: directory "' + inputs[1] + '" not found or not empty', fg='red')
-                statusBar.after(5000, backToReady)
-            except Exception:
-                statusBar.config(text='Error: unable to remove directory', fg='red')
-                statusBar.after(2000, backToReady)
-            ftp_print()
-        
-        elif inputs[0] == 'op':         # open file. if not present, download file then open
-            try:
-                if os.path.isfile(inputs[1]):
-                    os.startfile(inputs[1])
-                    statusBar.config(text='Opening file...', fg='green')
-                    statusBar.after(5000, backToReady)
-                else:
-                    if inputs[1] in ftp.nlst():
-                        statusBar.config(text='Downloading and opening file...', fg='green')
-                        ftp.retrbinary('RETR ' + inputs[1], open(inputs[1], 'wb').write)
-                        statusBar.after(5000, backToReady)
-                        os.startfile(inputs[1])
-                    else:
-                        statusBar.config(text='Error: file "' + inputs[1] + '" not found for download', fg='red')
-                        statusBar.after(5000, backToReady)
-            except Exception:
-                statusBar.config(text='Error: unable to download and open file', fg='red')
-                statusBar.after(2000, backToReady)
-            ftp_print()
-        
-        elif inputs[0] == 'exit':      # exit program by calling closeWindow() for confirmation
-            closeWindow()
-    except Exception:
-       messagebox.showerror('Error', 'FTP Error: 421 Timeout\nRestart client')
+    if inputs[0] == 'exit':             # exit program by calling closeWindow() for confirmation
+        closeWindow()
+    elif inputs[0] in ('jobs', 'cancel', 'pause', 'resume'):
+        jobControl(inputs)
+    elif inputs[0] == 'metrics':
+        metricsCommand(inputs)
+    elif inputs[0] in ('compress', 'verify'):
+        optionCommand(inputs)
+    elif inputs[0] == 'sort':           # only reorders what is already on screen, no server round trip
+        if len(inputs) > 1 and inputs[1] in ('name', 'size', 'date'):
+            listView.sort(inputs[1])
+        else:
+            showStatus('Error: sort by name, size or date', 'red', 2000)
+    elif inputs[0] in ftpEngine.commandHandlers:
+        # transfers run side by side on their own sessions; anything that changes the directory or its
+        # contents waits for earlier jobs and holds back later ones, so commands still apply in the order typed
+        transfers.submit(input, ftpEngine.runCommand, ftpEngine.commandHandlers[inputs[0]], inputs,
+                         exclusive=inputs[0] not in ftpEngine.transferCommands)
+
+
+# jobs/cancel/pause/resume only flip flags on job objects, so they run straight away on the main thread
+def jobControl(inputs):
+    if inputs[0] == 'jobs':
+        jobs = transfers.list()
+        if jobs:
+            showStatus('   '.join(describeJob(job) for job in jobs), 'black', 6000)
+        else:
+            showStatus('No queued or running jobs', 'black', 2000)
+        return
+    if len(inputs) > 1:
+        job = transfers.get(int(inputs[1])) if inputs[1].isdigit() else None
+        if job is None:
+            showStatus('Error: no job "' + inputs[1] + '"', 'red', 2000)
+            return
+        jobs = [job]
+    else:
+        jobs = transfers.list()
+    for job in jobs:
+        getattr(job, inputs[0])()       # job.cancel(), job.pause() or job.resume()
+    showStatus(inputs[0].capitalize() + ': ' + (', '.join('#%d' % job.id for job in jobs) or 'no jobs'), 'green', 2000)
+
+# e.g. '#3 get big.iso 45% (12.3 MB, 2.1 MB/s)'
+def describeJob(job):
+    text = '#%d %s' % (job.id, job.name)
+    if job.percent() is not None:
+        text += ' %d%%' % job.percent()
+    if job.done:
+        rate = job.rate()
+        text += ' (' + formatSize(job.done) + ('' if rate is None else ', ' + formatSize(int(rate)) + '/s') + ')'
+    if job.state != 'running':
+        text += ' [' + job.state + ']'
+    return text
+
+statusColours = {'ok': 'green', 'error': 'red'}
+
+# compress/verify on|off; transfers already running keep the setting they started with
+def optionCommand(inputs):
+    if len(inputs) > 1 and inputs[1] in ('on', 'off'):
+        setattr(dataPath, inputs[0], inputs[1] == 'on')
+        showStatus(inputs[0].capitalize() + ' ' + inputs[1], 'green', 2000)
+    else:
+        showStatus('Error: ' + inputs[0] + ' on or ' + inputs[0] + ' off', 'red', 2000)
+
+# metrics opens the live panel; metrics export <file> saves the counters, metrics reset clears them
+def metricsCommand(inputs):
+    if len(inputs) == 1:
+        metricsDisplay()
+    elif inputs[1] == 'reset':
+        metrics.reset()
+        showStatus('Metrics cleared', 'green', 2000)
+    elif inputs[1].startswith('export '):
+        path = inputs[1][7:].strip()
+        try:
+            metrics.export(path)
+            showStatus('Metrics saved to "' + path + '"', 'green', 3000)
+        except OSError:
+            showStatus('Error: unable to write "' + path + '"', 'red', 3000)
+    else:
+        showStatus('Error: metrics, metrics export [file] or metrics reset', 'red', 3000)
+
+# window showing running jobs with their rates, control round trips per command, data connection
+# setup times and the latest commands; redrawn every second until it is closed
+def metricsDisplay():
+    metricsWindow = Toplevel(root)
+    metricsWindow.title('Metrics')
+    metricsText = Text(metricsWindow, width=100, height=32, wrap=NONE, font=('courier', 9))
+    metricsText.pack(fill=BOTH, expand=TRUE)
+
+    def refresh():
+        if not metricsWindow.winfo_exists():
+            return
+        metricsText.config(state='normal')
+        metricsText.delete('1.0', END)
+        metricsText.insert(END, metricsReport())
+        metricsText.config(state='disabled')
+        metricsWindow.after(1000, refresh)
+
+    refresh()
+    metricsWindow.iconbitmap(r'ftp_icon.ico')
+
+def metricsReport():
+    snapshot = metrics.snapshot()
+    lines = ['RUNNING JOBS']
+    lines += ['  ' + describeJob(job) for job in transfers.list()] or ['  none']
+    lines += ['', 'CONTROL ROUND TRIPS'.ljust(26) + 'count      mean       p95       max']
+    for verb, timings in snapshot['control'].items():
+        lines.append('  ' + verb.ljust(24) + formatTimings(timings))
+    lines += ['', 'DATA CONNECTION SETUP'.ljust(26) + formatTimings(snapshot['dataSetup'])]
+    lines += ['', 'RECENT COMMANDS'.ljust(42) + 'result      time       size        rate    stalled']
+    for record in reversed(snapshot['commands'][-20:]):
+        rate = record['bytesPerSecond']
+        lines.append('  ' + record['command'][:38].ljust(40) + record['outcome'].ljust(10) + ('%.2f s' % record['seconds']).rjust(8) +
+                     formatSize(record['bytes']).rjust(11) + ('' if rate is None else formatSize(rate) + '/s').rjust(12) +
+                     ('%.1f s' % record['stalled']).rjust(11))
+    return '\n'.join(lines)
+
+# '  12   3.1 ms   5.0 ms   9.2 ms'
+def formatTimings(timings):
+    text = str(timings['count']).rjust(5)
+    for key in ('mean', 'p95', 'max'):
+        text += ('-' if timings[key] is None else '%.1f ms' % (timings[key] * 1000)).rjust(10)
+    return text
+
+# runs on the Tk main thread every 100 ms: apply the results of finished jobs and show live progress
+def pollTransfers():
+    for state, job in transfers.poll():
+        if state == 'done':
+            status, listing = job.result
+            if status:
+                text, level, delay = status
+                showStatus(text, statusColours[level], delay)
+            ftp_print(*listing)
+        elif state == 'cancelled':
+            showStatus('Cancelled "' + job.name + '"', 'red', 3000)
+        elif state == 'failed':
+            showStatus('Error: ' + (str(job.error) or type(job.error).__name__), 'red', 4000)   # the pool reconnects by itself
+    showProgress()
+    root.after(100, pollTransfers)
+
+# progress only takes over the status bar while it isn't showing a command result
+def showProgress():
+    global progressShown
+    if statusBar['text'] != 'Ready' and not progressShown:
+        return
+    moving = [job for job in transfers.list() if job.done]
+    if moving:
+        statusBar.config(text='   '.join(describeJob(job) for job in moving), fg='blue')
+        progressShown = True
+    elif progressShown:
+        backToReady()
+        progressShown = False
+
 
 # prints the current directory contents
-def ftp_print():
-
-    # ----- directoryItems content example -----
-    # [0]     drwxrwxr-x      d is directory , rwx is permission of owner, group, others (r=read, w=write, x=execute)
-    # [1]     2               number of immediate subdirectories + parent directory + itself (so 2 means no subdirectories)
-    # [2]     0               UID of user
-    # [3]     0               GID of user
-    # [4]     32768           size
-    # [5]     Dec             month
-    # [6]     11              date
-    # [7]     2016            year
-    # [8]      My             title
-    # [9]     Photos           ''
-    # [10]     ...             ''
-    # [11]     ...             ''
-
-    textbox.config(state='normal')                                          # allow textbox to be editable
-    textbox.delete('1.0', END)                                              # clear the text box
-    textbox.insert(INSERT, 'Current Directory ' + ftp.pwd() + '\n\n')       # display current accessed directory
-
-    lengthMax = 0
-    directoryItems = []
-    ftp.retrlines('LIST', directoryItems.append)                            # all ftp data of current directory stored in dictionItems for parsing
-
-    for i in range(len(directoryItems)):
-        directoryItems[i] = directoryItems[i].split()                       # split long string into its own items
-        directoryItems[i][8] = ' '.join(directoryItems[i][8:])              # combine title into one item
-        directoryItems[i][5] = ' '.join(directoryItems[i][5:8])             # combine the month, date, year
-        if lengthMax < len(directoryItems[i][8]):                           # get the longest title for column adjustment purposes
-            lengthMax = len(directoryItems[i][8])
-        if directoryItems[i][0][0] == 'd':                                  # check whether it is directory or a file so we can show 'dir' in the first column when needed
-            directoryItems[i][0] = 'dir'
-            directoryItems[i][4] = ''
-        else:
-            directoryItems[i][0] = '   '
-        
-        # depending on how big the size of folder/file is, divide and attach appropriate unit
-        if directoryItems[i][4] != '' and int(directoryItems[i][4]) >= 1073741824:
-            directoryItems[i][4] = round(int(directoryItems[i][4]) / 1073741824, 1)
-            directoryItems[i][4] = str(directoryItems[i][4]) + ' GB'
-        elif directoryItems[i][4] != '' and int(directoryItems[i][4]) >= 1048576:
-            directoryItems[i][4] = round(int(directoryItems[i][4]) / 1048576, 1)
-            directoryItems[i][4] = str(directoryItems[i][4]) + ' MB'
-        elif directoryItems[i][4] != '' and int(directoryItems[i][4]) >= 1024:
-            directoryItems[i][4] = round(int(directoryItems[i][4]) / 1024)
-            directoryItems[i][4] = str(directoryItems[i][4]) + ' kB'
-        elif directoryItems[i][4] != '':
-            directoryItems[i][4] = directoryItems[i][4] + ' B'
-    
-    # displaying headers NAME, SIZE, and DATE MODIFIED
-    textbox.insert(INSERT, '      ' + 'NAME'.ljust(lengthMax+11) + 'SIZE' + '          DATE MODIFIED  ' + '\n      ' +'---------'.ljust(lengthMax+6) + '---------     ------------------\n')
-    
-    # displaying folder/file names, size, and date modified
-    for i in range(len(directoryItems)):
-        textbox.insert(INSERT, directoryItems[i][0] + '   ' + directoryItems[i][8].ljust(lengthMax) + directoryItems[i][4].rjust(15) + directoryItems[i][5].rjust(23) + '  \n')
-    
-    textbox.config(state='disabled')                                        # disable textbox editability
+def ftp_print(directory, entries):
+    listView.show(directory, entries)
 
 # main FTP client window code
 try:
-    with ftplib.FTP(site_address, timeout=1000) as ftp:                         # use given ftp ip address from login to assign to 'ftp'
-        ftp.login(site_username, site_password)                                 # login using credentials from login window
+    with ftpEngine.start(site_address, site_username, site_password, loginSession, crawl=True) as pool:    # start from the session validated at login, index the tree in the background
+        transfers = TransferQueue(workers=4)                                    # worker threads that run the commands
+        progressShown = False                                                   # status bar is showing job progress, not a result
 
         root = Tk()
 
@@ -381,10 +402,10 @@ try:
         scrolly.pack(side=RIGHT, fill=Y)
         scrollx = Scrollbar(frame1, orient=HORIZONTAL)
         scrollx.pack(side=BOTTOM, fill=X)
-        textbox = Text(frame1, yscrollcommand=scrolly.set, xscrollcommand=scrollx.set, wrap=NONE)
+        textbox = Text(frame1, xscrollcommand=scrollx.set, wrap=NONE)
         textbox.pack(side=LEFT, fill=BOTH, expand=TRUE)
-        scrolly.config(command=textbox.yview)
         scrollx.config(command=textbox.xview)
+        listView = ListView(textbox, scrolly)                                   # scrolly moves through rows, not the text widget
 
         # buttons
         button1 = Button(frame3, text='Submit', width=25)                       # submit button for ftp commands
@@ -402,10 +423,13 @@ try:
         root.bind('<Return>', getEntry)                                         # press "Return" key to submit entry
         button1.bind('<Button-1>', getEntry)                                    # button press to submit entry
 
-        serverTitle['text'] = ftp.getwelcome()                                  # fill server title label with ftp welcome message
+        serverTitle['text'] = loginSession.getwelcome()                                  # fill server title label with ftp welcome message
         
-        ftp_print()                                                             # display parent directory on first login
+        transfers.submit('ls', ftpEngine.runCommand, None, [], exclusive=True)            # display parent directory on first login
+        root.after(100, pollTransfers)                                          # start applying job results on the main thread
+        if ftpEngine.indexError:                                                # carry on without find, but say why
+            showStatus('Remote index off: ' + ftpEngine.indexError, 'red', 6000)
 
         root.mainloop()                                                         # keep root window running to stay on screen
 except:
-    pass
\ No newline at end of file
+    pass
\ No newline at end of file
@@ -0,0 +1,358 @@
+# The command engine shared by the Tk window (ftpClient.py) and the headless scripting mode
+# (ftpCli.py): the pooled sessions, the current remote directory, the listing cache and one handler
+# per command. Nothing in here imports tkinter, so a script can load it without starting a display.
+
+import ftplib
+import os                           # for opening files after downloading them
+import posixpath                    # for building absolute remote paths
+import time
+from transferQueue import JobCancelled
+from transferMetrics import MeteredFTP, metrics           # control RTT, data setup, per-command rates
+from segmentedGet import segmentedDownload                # parallel multi-connection downloads
+from connectionPool import ConnectionPool                 # leased ftp sessions shared by the workers
+from listingCache import ListingCache, fetchListing       # cached directory listings
+import resumableTransfer                                  # resumable get/put with retries
+import dataPath                                           # MODE Z and streamed checksums for get/put
+from checksums import ChecksumMismatch
+import mirrorSync                                         # recursive mirror / reverse-mirror
+import batchCommands                                      # mget / mput / mdelete
+from remoteIndex import openIndex, IndexCrawler, INDEX_PATH     # searchable index of the remote tree
+
+site_address = None                 # login details, kept for opening extra sessions
+site_port = 21
+site_username = ''
+site_password = ''
+pool = None                         # ConnectionPool, set up by start()
+remoteDir = None                    # current remote directory
+listings = None                     # directory listings by remote path
+index = None                        # RemoteIndex every listing is saved to, None if disabled
+indexError = None                   # why the index couldn't be opened, None if it was (or is turned off)
+
+# log in (or adopt a session that already has) and set up the shared state; returns the pool, which
+# closes every session when used as a context manager. indexPath=None turns the remote index off and
+# crawl=True keeps it filled from a background thread, on a session of its own. The index is optional:
+# if its file can't be opened the client carries on without it and indexError says why. compress=True
+# deflates transfers (MODE Z) on servers that offer it; verify=False skips the checksum check after get/put
+def start(address, username, password, session=None, port=21, poolSize=4, indexPath=INDEX_PATH, crawl=False,
+          compress=False, verify=True):
+    global site_address
+    global site_port
+    global site_username
+    global site_password
+    global pool
+    global remoteDir
+    global listings
+    global index
+    global indexError
+    site_address = address
+    site_port = port
+    site_username = username
+    site_password = password
+    dataPath.compress = compress
+    dataPath.verify = verify
+    if session is None:
+        session = openSession()
+    pool = ConnectionPool(openSession, session, size=poolSize + 1 if crawl else poolSize)
+    try:
+        remoteDir = session.pwd()
+    except BaseException:
+        pool.close()
+        raise
+    index, indexError = openIndex(indexSite(username, address, port), indexPath) if indexPath else (None, None)
+    listings = ListingCache(ttl=120, maxDirs=64, index=index)
+    if crawl and index:
+        IndexCrawler(index, pool, remoteDir)
+    return pool
+
+# the name a server's entries are kept under in the index, so one file can hold several servers
+def indexSite(username, address, port):
+    return '%s@%s:%d' % (username, address, port)
+
+# worker side of a command: run the handler, then fetch the refreshed listing for ftp_print (or
+# whatever the command left to show, like find's matches)
+def runCommand(job, handler, inputs):
+    status = execute(job, handler, inputs) if handler else None
+    return status, job.listing or ftp_list()
+
+# run a command's handler and log its time, bytes, rate and stalls in metrics; returns its status
+def execute(job, handler, inputs):
+    started = time.monotonic()
+    outcome = 'failed'
+    try:
+        status = handler(job, inputs)
+        outcome = status[1] if status else 'ok'
+        return status
+    except JobCancelled:
+        outcome = 'cancelled'
+        raise
+    finally:
+        metrics.commandDone(job.name, outcome, time.monotonic() - started, job.moved, job.stalled)
+
+# download/upload with progress reporting. Both resume from where an interrupted attempt (or an
+# earlier run of the client) stopped and retry dropped connections with backoff. Both return the
+# checksum the transfer was verified with, None if it wasn't
+def downloadFile(job, remoteName, localName):
+    return resumableTransfer.download(lambda: pool.lease(remoteDir), remoteName, localName, job)
+
+def uploadFile(job, localName, remoteName):
+    return resumableTransfer.upload(lambda: pool.lease(remoteDir), localName, remoteName, job)
+
+def verified(algorithm):
+    return ' (' + algorithm + ' verified)' if algorithm else ''
+
+# open an extra logged-in session with the credentials given to start()
+def openSession():
+    session = MeteredFTP(timeout=1000)
+    session.connect(site_address, site_port)
+    session.login(site_username, site_password)
+    return session
+
+# ----- command handlers -----
+# each runs on a worker thread and returns the (text, level, delay) status message to show, or None.
+# level is 'ok' or 'error'; delay is how long (ms) the Tk window keeps the message up
+
+def ftp_cd(job, inputs):                # change directory
+    global remoteDir
+    try:
+        remoteDir = pool.run(lambda ftp: changeDirectory(ftp, inputs[1]), remoteDir)
+    except ftplib.error_perm:
+        return 'Error: invalid directory', 'error', 2000
+    except IndexError:
+        return 'Error: enter a valid directory', 'error', 2000
+    except Exception:
+        return 'Error: unable to change directory', 'error', 2000
+
+def changeDirectory(ftp, directory):
+    ftp.cwd(directory)
+    ftp.directory = ftp.pwd()           # let the pool know where this session now is
+    return ftp.directory
+
+def ftp_get(job, inputs):               # download file
+    try:
+        algorithm = downloadFile(job, inputs[1], inputs[1])
+        return 'File download successful' + verified(algorithm), 'ok', 2000
+    except ChecksumMismatch:
+        return 'Error: downloaded file does not match the server\'s checksum', 'error', 4000
+    except ftplib.error_perm:
+        return 'Error: failed to download file', 'error', 2000
+    except Exception:
+        return 'Error: unable to download file', 'error', 2000
+
+def ftp_pget(job, inputs):              # download file in parallel segments
+    try:
+        remotePath = posixpath.join(remoteDir, inputs[1])                   # extra sessions start in the home directory
+        with pool.lease(remoteDir) as ftp:
+            ftp.voidcmd('TYPE I')                                           # some servers refuse SIZE in ASCII mode
+            job.total = ftp.size(inputs[1])
+        segmentedDownload(openSession, remotePath, inputs[1], job.total, progress=job.progress)
+        return 'File download successful', 'ok', 2000
+    except ftplib.error_perm:
+        return 'Error: failed to download file', 'error', 2000
+    except Exception:
+        return 'Error: unable to download file', 'error', 2000
+
+def ftp_put(job, inputs):               # upload file
+    try:
+        algorithm = uploadFile(job, inputs[1], inputs[1])
+        listings.update(remoteDir, inputs[1], False, job.total)
+        return 'File "' + inputs[1] + '" upload successful' + verified(algorithm), 'ok', 4000
+    except ChecksumMismatch:
+        return 'Error: uploaded file does not match the server\'s checksum', 'error', 4000
+    except FileNotFoundError:
+        return 'Error: no such file "' + inputs[1] + '"', 'error', 3000
+    except Exception:
+        return 'Error: unable to upload file', 'error', 2000
+
+def ftp_mirror(job, inputs):            # download a directory tree, skipping files that haven't changed
+    try:
+        remoteRoot = posixpath.normpath(posixpath.join(remoteDir, inputs[1]))
+        localRoot = posixpath.basename(remoteRoot) or '.'
+        return mirrorStatus('Mirror', localRoot, mirrorSync.mirror(pool, remoteRoot, localRoot, job, listings=listings))
+    except IndexError:
+        return 'Error: enter a directory to mirror', 'error', 2000
+    except ftplib.error_perm:
+        return 'Error: invalid directory', 'error', 2000
+    except Exception:
+        return 'Error: unable to mirror directory', 'error', 2000
+
+def ftp_reverse_mirror(job, inputs):    # upload a local directory tree, skipping files that haven't changed
+    try:
+        localRoot = os.path.normpath(inputs[1])
+        remoteRoot = posixpath.join(remoteDir, os.path.basename(os.path.abspath(localRoot)))
+        return mirrorStatus('Reverse mirror', localRoot, mirrorSync.reverseMirror(pool, localRoot, remoteRoot, job, listings=listings))
+    except IndexError:
+        return 'Error: enter a directory to mirror', 'error', 2000
+    except FileNotFoundError:
+        return 'Error: no such directory "' + inputs[1] + '"', 'error', 3000
+    except Exception:
+        return 'Error: unable to mirror directory', 'error', 2000
+
+def mirrorStatus(action, name, counts):
+    text = '%s "%s": %d transferred, %d unchanged' % (action, name, counts['transferred'], counts['unchanged'])
+    if counts['failed']:
+        return text + ', %d failed' % len(counts['failed']), 'error', 6000
+    return text, 'ok', 6000
+
+def ftp_mget(job, inputs):              # download every remote file matching the patterns
+    try:
+        directory, entries = ftp_list()                                     # match against the (cached) listing
+        names = batchCommands.expandRemote(entries, batchCommands.splitPatterns(inputs[1]))
+        if not names:
+            return 'Error: no files match "' + inputs[1] + '"', 'error', 3000
+        done, failures = batchCommands.getMany(pool, directory, names, job)
+        return batchStatus('downloaded', done, failures)
+    except (IndexError, ValueError):
+        return 'Error: enter a file pattern', 'error', 2000
+    except Exception:
+        return 'Error: unable to download files', 'error', 2000
+
+def ftp_mput(job, inputs):              # upload every local file matching the patterns
+    try:
+        paths = batchCommands.expandLocal(batchCommands.splitPatterns(inputs[1]))
+        if not paths:
+            return 'Error: no local files match "' + inputs[1] + '"', 'error', 3000
+        done, failures = batchCommands.putMany(pool, remoteDir, paths, job)
+        for name, size in done:
+            listings.update(remoteDir, name, False, size)
+        return batchStatus('uploaded', done, failures)
+    except (IndexError, ValueError):
+        return 'Error: enter a file pattern', 'error', 2000
+    except Exception:
+        return 'Error: unable to upload files', 'error', 2000
+
+def ftp_mdelete(job, inputs):           # delete every remote file matching the patterns
+    try:
+        directory, entries = ftp_list()
+        names = batchCommands.expandRemote(entries, batchCommands.splitPatterns(inputs[1]))
+        if not names:
+            return 'Error: no files match "' + inputs[1] + '"', 'error', 3000
+        done, failures = batchCommands.deleteMany(pool, directory, names, job)
+        for name in done:
+            listings.remove(directory, name)
+        return batchStatus('deleted', done, failures)
+    except (IndexError, ValueError):
+        return 'Error: enter a file pattern', 'error', 2000
+    except Exception:
+        return 'Error: unable to delete files', 'error', 2000
+
+def batchStatus(action, done, failures):
+    text = '%d files %s' % (len(done), action)
+    if failures:
+        return text + ', %d failed' % len(failures), 'error', 6000
+    return text, 'ok', 4000
+
+def ftp_delete(job, inputs):            # delete file
+    try:
+        pool.run(lambda ftp: ftp.delete(inputs[1]), remoteDir)
+        listings.remove(remoteDir, inputs[1])
+        return 'File "' + inputs[1] + '" deleted', 'ok', 6000
+    except ftplib.error_perm:
+        return 'Error: unable to find file "' + inputs[1] + '"', 'error', 3000
+    except Exception:
+        return 'Error: unable to delete file', 'error', 2000
+
+def ftp_rename(job, inputs):            # rename file
+    try:
+        inputs = inputs[1].split(' > ')
+        pool.run(lambda ftp: ftp.rename(inputs[0], inputs[1]), remoteDir)
+        listings.rename(remoteDir, inputs[0], inputs[1])
+        return 'File name changed from "' + inputs[0] + '" to "' + inputs[1] + '"', 'ok', 4000
+    except ftplib.error_perm:
+        return 'Error: "' + inputs[0] + '" file not found', 'error', 3000
+    except IndexError:
+        return 'Error: invalid file name', 'error', 2000
+    except Exception:
+        return 'Error: name change operation failed', 'error', 2000
+
+def ftp_mkdir(job, inputs):             # create a new directory
+    try:
+        pool.run(lambda ftp: ftp.mkd(inputs[1]), remoteDir)
+        listings.update(remoteDir, inputs[1], True)
+        return 'Directory "' + inputs[1] + '" successfully created', 'ok', 4000
+    except Exception:
+        return 'Error: unable to create directory', 'error', 2000
+
+def ftp_rmdir(job, inputs):             # delete a directory
+    try:
+        pool.run(lambda ftp: ftp.rmd(inputs[1]), remoteDir)
+        listings.remove(remoteDir, inputs[1])
+        return 'Directory "' + inputs[1] + '" successfully removed', 'ok', 6000
+    except ftplib.error_perm:
+        return 'Error: directory "' + inputs[1] + '" not found or not empty', 'error', 5000
+    except Exception:
+        return 'Error: unable to remove directory', 'error', 2000
+
+def ftp_op(job, inputs):                # open file. if not present, download file then open
+    try:
+        if os.path.isfile(inputs[1]):
+            os.startfile(inputs[1])
+            return 'Opening file...', 'ok', 5000
+        entry = lookup(inputs[1])
+        if entry is None or entry.isDir:
+            return 'Error: file "' + inputs[1] + '" not found for download', 'error', 5000
+        downloadFile(job, inputs[1], inputs[1])
+        os.startfile(inputs[1])
+        return 'Downloading and opening file...', 'ok', 5000
+    except Exception:
+        return 'Error: unable to download and open file', 'error', 2000
+
+def ftp_ls(job, inputs):                # drop the cached listing so runCommand fetches it again
+    listings.invalidate(remoteDir)
+
+def ftp_find(job, inputs):              # search the index of everything below the current directory
+    if index is None:
+        return 'Error: the remote index is turned off', 'error', 3000
+    try:
+        matches = index.find(inputs[1], remoteDir)
+    except IndexError:
+        return 'Error: enter a name or pattern to find', 'error', 2000
+    except Exception:
+        return 'Error: unable to search the index', 'error', 2000
+    job.listing = remoteDir + '   (find "' + inputs[1] + '")', matches     # names are paths below remoteDir
+    if not matches:
+        return 'No indexed files match "' + inputs[1] + '"', 'error', 3000
+    return '%d indexed files match "%s"' % (len(matches), inputs[1]), 'ok', 4000
+
+commandHandlers = {
+    'cd': ftp_cd,
+    'get': ftp_get,
+    'pget': ftp_pget,
+    'put': ftp_put,
+    'mirror': ftp_mirror,
+    'reverse-mirror': ftp_reverse_mirror,
+    'delete': ftp_delete,
+    'mget': ftp_mget,
+    'mput': ftp_mput,
+    'mdelete': ftp_mdelete,
+    'rename': ftp_rename,
+    'mkdir': ftp_mkdir,
+    'rmdir': ftp_rmdir,
+    'op': ftp_op,
+    'ls': ftp_ls,
+    'find': ftp_find,
+}
+transferCommands = ('get', 'pget', 'put', 'op', 'mirror', 'mget')
+
+# current directory and its entries, from the listing cache when it is still fresh; runs on a worker thread
+def ftp_list():
+    directory = remoteDir                                                   # read once: a cd may land while we list
+    return directory, listDirectory(directory)
+
+def listDirectory(directory):
+    entries = listings.get(directory)
+    if entries is None:
+        started = time.monotonic()
+        entries = pool.run(lambda ftp: fetchListing(ftp, 'MLST' in pool.features), directory)
+        metrics.commandDone('list ' + directory, 'ok', time.monotonic() - started)
+        listings.put(directory, entries)
+    return entries
+
+# the entry for a file or directory named relative to the current directory, None if there is none.
+# The index is only trusted when it has the name: anything can appear on the server without the
+# client seeing it, so a miss lists the directory (which also updates the index) instead of an NLST
+def lookup(name):
+    directory, base = listings.locate(remoteDir, name)
+    entry = index.entry(directory, base) if index else None
+    if entry is not None:
+        return entry
+    return next((entry for entry in listDirectory(directory) if entry.name == base), None)
@@ -0,0 +1,174 @@
+# Streaming parser for directory listings. Lines are fed one at a time straight from retrlines,
+# e.g. ftp.retrlines('LIST', parser.feed), and become compact ListEntry records. The listing format
+# (Unix ls -l, DOS/IIS or MLSD facts) is detected from the first line and re-detected whenever a
+# line stops matching, so mixed or unusual servers still parse.
+
+import re
+import time
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# -rw-r--r--   1 owner group     32768 Dec 11  2016 My  Photos
+# lrwxrwxrwx   1 owner group        11 Jan  3 10:30 latest -> releases/v2
+# the size is the number just before the date (after 1-3 link/owner/group columns) and the name is
+# everything after the single space that follows the date, so names keep repeated spaces
+unixLine = re.compile(r'([-dlbcps])\S*\s+(?:\S+\s+){1,3}?(\d+)\s+([A-Za-z]{3}\s+\d{1,2}\s+(?:\d{1,2}:\d{2}|\d{4})) (.*)')
+
+# 12-11-16  09:30AM       <DIR>          My Photos
+# 12-11-2016  21:30             32768 notes.txt
+dosLine = re.compile(r'(\d{2}-\d{2}-\d{2,4}\s+\d{1,2}:\d{2}(?:\s?[AaPp][Mm])?)\s+(<DIR>|\d+)\s+(.*)')
+
+# type=file;size=32768;modify=20161211093000; notes.txt
+mlsdLine = re.compile(r'((?:[\w.-]+=[^;]*;)+) (.*)')
+
+
+class ListEntry:
+    __slots__ = ('name', 'isDir', 'size', 'modified', 'target')
+
+    def __init__(self, name, isDir, size, modified, target=None):
+        self.name = name
+        self.isDir = isDir
+        self.size = size
+        self.modified = modified                # as the server sent it, see formatModified
+        self.target = target                    # symlink target, Unix listings only
+
+    def __repr__(self):
+        return 'ListEntry(%r, %r, %r, %r)' % (self.name, self.isDir, self.size, self.modified)
+
+
+def parseUnix(line):
+    match = unixLine.match(line)
+    if match is None:
+        return None
+    kind, size, modified, name = match.groups()
+    if name in ('.', '..'):                     # LIST -a and some servers (pure-ftpd) include them
+        return False
+    target = None
+    if kind == 'l' and ' -> ' in name:
+        name, target = name.split(' -> ', 1)
+    return ListEntry(name, kind == 'd', int(size), modified, target)
+
+
+def parseDos(line):
+    match = dosLine.match(line)
+    if match is None:
+        return None
+    modified, size, name = match.groups()
+    if name in ('.', '..'):
+        return False
+    if size == '<DIR>':
+        return ListEntry(name, True, 0, modified)
+    return ListEntry(name, False, int(size), modified)
+
+
+def parseMlsd(line):
+    match = mlsdLine.match(line)
+    if match is None:
+        return None
+    facts, name = match.groups()
+    kind = size = modify = None
+    for fact in facts.split(';'):
+        key, _, value = fact.partition('=')
+        key = key.lower()
+        if key == 'type':
+            kind = value.lower()
+        elif key == 'size' or key == 'sizd':
+            size = value
+        elif key == 'modify':
+            modify = value
+    if kind in ('cdir', 'pdir'):                # the '.' and '..' entries
+        return False
+    return ListEntry(name, kind == 'dir', int(size) if size else 0, modify or '')
+
+
+parsers = (parseMlsd, parseUnix, parseDos)
+
+
+class ListParser:
+
+    def __init__(self):
+        self.entries = []
+        self.parse = None                       # parser that matched the last line
+        self.skipped = 0                        # lines no format understood
+
+    def feed(self, line):
+        if self.parse is not None:
+            entry = self.parse(line)
+            if entry is not None:
+                if entry:
+                    self.entries.append(entry)
+                return
+        if not line or line.startswith('total '):
+            return
+        for parse in parsers:
+            entry = parse(line)
+            if entry is not None:
+                self.parse = parse
+                if entry:
+                    self.entries.append(entry)
+                return
+        self.skipped += 1
+
+
+# parse a whole listing at once, e.g. the lines of a saved LIST
+def parseListing(lines):
+    parser = ListParser()
+    for line in lines:
+        parser.feed(line)
+    return parser.entries
+
+
+# entry.modified in one display form, 'Dec 11 2016' or 'Dec 11 10:30', whatever the listing format
+def formatModified(modified):
+    if modified[:8].isdigit() and len(modified) >= 12:                      # MLSD: YYYYMMDDHHMMSS in UTC
+        try:
+            return time.strftime('%b %d %Y', time.strptime(modified[:14], '%Y%m%d%H%M%S'))
+        except ValueError:
+            return modified
+    if modified[:2].isdigit() and modified[2:3] == '-':                     # DOS: MM-DD-YY HH:MM[AM|PM]
+        date, _, clock = modified.partition(' ')
+        month, day, year = date.split('-')
+        if len(year) == 2:
+            year = ('20' if int(year) < 70 else '19') + year
+        return '%s %s %s' % (MONTHS[int(month) - 1], day, year)
+    return ' '.join(modified.split())                                      # Unix: already 'Dec 11 2016'
+
+
+# entry.modified as a sortable 'YYYYMMDDHHMM' string, whatever the listing format
+def modifiedKey(modified):
+    if modified[:8].isdigit():                                              # MLSD
+        return modified[:12]
+    try:
+        if modified[:2].isdigit() and modified[2:3] == '-':                 # DOS
+            date, clock = modified.split(None, 1)
+            month, day, year = date.split('-')
+            if len(year) == 2:
+                year = ('20' if int(year) < 70 else '19') + year
+            clock = clock.strip().upper()
+            hour, minute = clock.split(':')
+            hour = int(hour)
+            if clock.endswith('M'):                                         # 12-hour clock
+                hour = hour % 12 + (12 if clock.endswith('PM') else 0)
+            return '%s%s%s%02d%s' % (year, month, day, hour, minute[:2])
+        monthName, day, yearOrClock = modified.split()                      # Unix
+        month = MONTHS.index(monthName.capitalize()) + 1
+        if ':' not in yearOrClock:
+            return '%s%02d%02d0000' % (yearOrClock, month, int(day))
+        # recent files show a time instead of the year: it's this year unless that would be in the future
+        now = time.localtime()
+        year = now.tm_year - 1 if (month, int(day)) > (now.tm_mon, now.tm_mday) else now.tm_year
+        hour, minute = yearOrClock.split(':')
+        return '%d%02d%02d%02d%s' % (year, month, int(day), int(hour), minute)
+    except ValueError:
+        return ''
+
+
+# depending on how big the size of folder/file is, divide and attach appropriate unit
+def formatSize(size):
+    if size >= 1073741824:
+        return str(round(size / 1073741824, 1)) + ' GB'
+    elif size >= 1048576:
+        return str(round(size / 1048576, 1)) + ' MB'
+    elif size >= 1024:
+        return str(round(size / 1024)) + ' kB'
+    return str(size) + ' B'
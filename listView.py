@@ -0,0 +1,126 @@
+# Virtual list view for the directory listing. Only the rows that fit in the text box are formatted
+# and inserted: the vertical scrollbar and mouse wheel move a row offset instead of scrolling the
+# Text widget, so a 100k-entry directory draws as fast as a 10-entry one. Clicking a column header
+# sorts by it (again to reverse); each column's sort keys are computed once per listing.
+
+from tkinter import END
+from tkinter import font
+
+from listParser import formatModified, formatSize, modifiedKey
+
+HEADER_LINES = 4                        # current directory, blank line, column titles, dashes
+
+sortKeys = {
+    'name': lambda entry: (not entry.isDir, entry.name.lower()),
+    'size': lambda entry: -1 if entry.isDir else entry.size,
+    'date': lambda entry: modifiedKey(entry.modified),
+}
+
+
+class ListView:
+
+    def __init__(self, textbox, scrolly):
+        self.textbox = textbox
+        self.scrolly = scrolly
+        self.directory = None
+        self.entries = []
+        self.order = None               # entry indexes in display order, None = order the server sent
+        self.keys = {}                  # column -> sort key per entry, built the first time it's sorted
+        self.sortColumn = None
+        self.reverse = False
+        self.top = 0                    # index of the first row on screen
+        self.lengthMax = 0
+        self.lineHeight = font.Font(font=textbox['font']).metrics('linespace')
+        textbox.config(yscrollcommand='')
+        scrolly.config(command=self.scroll)
+        textbox.bind('<Configure>', lambda event: self.render())
+        textbox.bind('<MouseWheel>', lambda event: self.wheel(-3 if event.delta > 0 else 3))
+        textbox.bind('<Button-4>', lambda event: self.wheel(-3))
+        textbox.bind('<Button-5>', lambda event: self.wheel(3))
+        for column in sortKeys:
+            textbox.tag_bind('sort-' + column, '<Button-1>', lambda event, column=column: self.sort(column))
+            textbox.tag_config('sort-' + column, foreground='blue')
+
+    def show(self, directory, entries):
+        if directory != self.directory:
+            self.top = 0
+        self.directory = directory
+        self.entries = entries
+        self.keys = {}
+        self.lengthMax = max(map(len, [entry.name for entry in entries]), default=0)
+        self.order = self.sortedOrder() if self.sortColumn else None
+        self.render()
+
+    # click on a header: sort by that column, or reverse it if it is already the sort column
+    def sort(self, column):
+        self.reverse = not self.reverse if column == self.sortColumn else False
+        self.sortColumn = column
+        self.order = self.sortedOrder()
+        self.top = 0
+        self.render()
+        return 'break'
+
+    def sortedOrder(self):
+        keys = self.keys.get(self.sortColumn)
+        if keys is None:
+            keys = self.keys[self.sortColumn] = [sortKeys[self.sortColumn](entry) for entry in self.entries]
+        return sorted(range(len(keys)), key=keys.__getitem__, reverse=self.reverse)
+
+    def visibleRows(self):
+        height = self.textbox.winfo_height()
+        if height <= 1:                 # not drawn yet, go by the configured height in lines
+            return max(1, int(self.textbox['height']) - HEADER_LINES)
+        return max(1, height // self.lineHeight - HEADER_LINES)
+
+    def scroll(self, *args):
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.entries))
+        elif args[0] == 'scroll':
+            self.top += int(args[1]) * (self.visibleRows() if args[2] == 'pages' else 1)
+        self.render()
+
+    def wheel(self, rows):
+        self.top += rows
+        self.render()
+        return 'break'                  # stop the Text widget scrolling its own (tiny) contents
+
+    def formatRow(self, entry):
+        kind, size = ('dir', '') if entry.isDir else ('   ', formatSize(entry.size))
+        return kind + '   ' + entry.name.ljust(self.lengthMax) + size.rjust(15) + formatModified(entry.modified).rjust(23) + '  '
+
+    def title(self, column, text):
+        if column != self.sortColumn:
+            return text
+        return text + (' v' if self.reverse else ' ^')
+
+    def render(self):
+        if self.directory is None:
+            return
+        rows = self.visibleRows()
+        count = len(self.entries)
+        self.top = max(0, min(self.top, count - rows))
+        if self.order is None:
+            visible = self.entries[self.top:self.top + rows]
+        else:
+            visible = [self.entries[i] for i in self.order[self.top:self.top + rows]]
+
+        textbox = self.textbox
+        textbox.config(state='normal')                                      # allow textbox to be editable
+        textbox.delete('1.0', END)                                          # clear the text box
+        textbox.insert(END, 'Current Directory ' + self.directory + '\n\n') # display current accessed directory
+
+        # displaying headers NAME, SIZE, and DATE MODIFIED, each one clickable to sort
+        name = self.title('name', 'NAME')
+        size = self.title('size', 'SIZE')
+        textbox.insert(END, '      ', (), name, 'sort-name', ' ' * (self.lengthMax + 11 - len(name)), (),
+                       size, 'sort-size', ' ' * (14 - len(size)), (), self.title('date', 'DATE MODIFIED'), 'sort-date',
+                       '  \n      ' + '---------'.ljust(self.lengthMax + 6) + '---------     ------------------\n')
+
+        # displaying folder/file names, size, and date modified ('dir' in the first column for directories)
+        textbox.insert(END, '\n'.join(self.formatRow(entry) for entry in visible))
+        textbox.config(state='disabled')                                    # disable textbox editability
+
+        if count:
+            self.scrolly.set(self.top / count, (self.top + len(visible)) / count)
+        else:
+            self.scrolly.set(0, 1)
@@ -0,0 +1,97 @@
+# Per-directory cache of remote listings. Listings expire after a TTL and the least recently used
+# directories are evicted once the cache is full. Commands that change a directory (put, delete,
+# rename, mkdir, rmdir) patch the cached listing in place instead of forcing a fresh LIST.
+# Given a RemoteIndex, every listing and patch is passed on to it as well.
+
+import collections
+import posixpath
+import threading
+import time
+
+import dataPath
+from listParser import ListEntry, ListParser
+
+
+# fetch the listing of the session's current directory, using MLSD when the server has it
+def fetchListing(ftp, useMlsd):
+    parser = ListParser()
+    dataPath.transferMode(ftp, 'S')
+    ftp.retrlines('MLSD' if useMlsd else 'LIST', parser.feed)
+    return parser.entries
+
+
+class ListingCache:
+
+    def __init__(self, ttl=120, maxDirs=64, index=None):
+        self.ttl = ttl                                  # seconds before a listing is fetched again
+        self.maxDirs = maxDirs                          # directories kept before the oldest is evicted
+        self.index = index                              # persistent RemoteIndex kept in step, if any
+        self.dirs = collections.OrderedDict()           # path -> (fetched time, {name: ListEntry})
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            cached = self.dirs.get(path)
+            if cached is None:
+                return None
+            if time.monotonic() - cached[0] > self.ttl:
+                del self.dirs[path]
+                return None
+            self.dirs.move_to_end(path)
+            return list(cached[1].values())
+
+    def put(self, path, entries):
+        with self.lock:
+            self.dirs[path] = (time.monotonic(), {entry.name: entry for entry in entries})
+            self.dirs.move_to_end(path)
+            while len(self.dirs) > self.maxDirs:
+                self.dirs.popitem(last=False)
+        if self.index:
+            self.index.put(path, entries)
+
+    # path of a command argument split into (parent directory, name) relative to the current directory
+    def locate(self, directory, name):
+        path = posixpath.normpath(posixpath.join(directory, name))
+        return posixpath.dirname(path), posixpath.basename(path)
+
+    # add or replace one entry after a put or mkdir
+    def update(self, directory, name, isDir, size=0):
+        parent, base = self.locate(directory, name)
+        entry = ListEntry(base, isDir, size, time.strftime('%Y%m%d%H%M%S', time.gmtime()))
+        with self.lock:
+            if parent in self.dirs:
+                self.dirs[parent][1][base] = entry
+        if self.index:
+            self.index.update(directory, name, isDir, size)
+
+    # drop one entry after a delete or rmdir, along with any cached listings below it
+    def remove(self, directory, name):
+        parent, base = self.locate(directory, name)
+        with self.lock:
+            if parent in self.dirs:
+                self.dirs[parent][1].pop(base, None)
+        self.invalidate(posixpath.join(parent, base))
+        if self.index:
+            self.index.remove(directory, name)
+
+    def rename(self, directory, oldName, newName):
+        oldParent, oldBase = self.locate(directory, oldName)
+        newParent, newBase = self.locate(directory, newName)
+        with self.lock:
+            entry = self.dirs[oldParent][1].pop(oldBase, None) if oldParent in self.dirs else None
+            if newParent in self.dirs:
+                if entry is None:
+                    del self.dirs[newParent]            # don't know what moved in, so list it again next time
+                else:
+                    entry.name = newBase
+                    self.dirs[newParent][1][newBase] = entry
+        self.invalidate(posixpath.join(oldParent, oldBase))
+        if self.index:
+            self.index.rename(directory, oldName, newName)
+
+    # forget a directory and everything cached below it
+    def invalidate(self, path):
+        prefix = path.rstrip('/') + '/'
+        with self.lock:
+            for cached in [cached for cached in self.dirs if cached == path or cached.startswith(prefix)]:
+                del self.dirs[cached]
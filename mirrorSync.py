@@ -0,0 +1,222 @@
+# Recursive directory sync. mirror copies a remote tree into a local directory and reverseMirror
+# copies a local tree up to the server. The remote tree is crawled with a bounded number of listings
+# in flight, and a file is only transferred when it is missing, its size differs, or its timestamp
+# (MLSD modify or MDTM) says it changed and, where the server offers HASH/XCRC/XMD5, the checksums
+# disagree as well.
+
+import calendar
+import ftplib
+import os
+import posixpath
+import threading
+import time
+
+import resumableTransfer
+from checksums import fileChecksum, remoteChecksum
+from listingCache import fetchListing
+from transferQueue import FileProgress, runBounded
+
+WORKERS = 4                             # listings/transfers in flight at once
+TIME_SLACK = 2                          # seconds apart that still count as the same time (FAT rounds to 2 s)
+MDTM = 'mdtm'                           # questions the unchanged checks ask their engine, see decide()
+CHECKSUM = 'checksum'
+
+
+def mlsdTime(modified):
+    if modified[:14].isdigit():
+        return calendar.timegm(time.strptime(modified[:14], '%Y%m%d%H%M%S'))
+    return None
+
+
+def mdtmTime(ftp, name):
+    try:
+        return calendar.timegm(time.strptime(ftp.sendcmd('MDTM ' + name)[4:18], '%Y%m%d%H%M%S'))
+    except (ftplib.error_perm, ValueError):
+        return None
+
+
+def checksumsMatch(pool, directory, name, localPath):
+    if not any(feature in pool.features for feature in ('HASH', 'XCRC', 'XMD5')):
+        return False
+    remote = pool.run(lambda ftp: remoteChecksum(ftp, name, pool.features), directory)
+    return remote is not None and fileChecksum(localPath, remote[0]) == remote[1]
+
+
+# The skip-or-transfer decisions of mirror and reverseMirror, shared with asyncEngine. Each is a
+# generator that yields MDTM when it needs the remote file's MDTM time and CHECKSUM when it needs to
+# know whether the checksums match, and is sent the answer; decide() drives one with blocking calls
+# and asyncEngine drives it with coroutines, so both engines skip exactly the same files
+
+# whether localPath is an up-to-date copy of the remote entry; returns (unchanged, remote time or None)
+def downloadUnchanged(localPath, entry):
+    remoteTime = mlsdTime(entry.modified)
+    if not (os.path.isfile(localPath) and os.path.getsize(localPath) == entry.size):
+        return False, remoteTime
+    if remoteTime is None:                                                  # LIST times are too coarse: ask with MDTM
+        remoteTime = yield MDTM
+    unchanged = remoteTime is not None and abs(os.path.getmtime(localPath) - remoteTime) <= TIME_SLACK
+    if not unchanged and (yield CHECKSUM):
+        unchanged = True
+        if remoteTime is not None:
+            os.utime(localPath, (remoteTime, remoteTime))                   # so the next run can skip the checksum
+    return unchanged, remoteTime
+
+
+# whether the remote entry (None if missing) is an up-to-date copy of the local file with stat info
+def uploadUnchanged(info, remote):
+    if remote is None or remote.size != info.st_size:
+        return False
+    remoteTime = mlsdTime(remote.modified)
+    if remoteTime is None:
+        remoteTime = yield MDTM
+    # without MFMT the server stamps uploads with the upload time, so "not older" means unchanged
+    if remoteTime is not None and remoteTime >= info.st_mtime - TIME_SLACK:
+        return True
+    return (yield CHECKSUM)
+
+
+# run one of the decisions above, answering its questions with answer(question); returns its result
+def decide(decision, answer):
+    try:
+        question = next(decision)
+        while True:
+            question = decision.send(answer(question))
+    except StopIteration as done:
+        return done.value
+
+
+# answers for a decision about the remote file name in directory and its local copy localPath
+def answerer(pool, directory, name, localPath):
+    def answer(question):
+        if question == MDTM:
+            return pool.run(lambda ftp: mdtmTime(ftp, name), directory)
+        return checksumsMatch(pool, directory, name, localPath)
+    return answer
+
+
+# walk the remote tree under root; returns ({relative path: ListEntry} for files, set of relative
+# directory paths, failures). Listings found on the way go into the listing cache if one is given
+def crawlRemote(pool, root, workers=WORKERS, listings=None):
+    files = {}
+    dirs = set()
+    lock = threading.Lock()
+    useMlsd = 'MLST' in pool.features
+
+    def visit(relative, submit):
+        path = posixpath.join(root, relative) if relative else root
+        entries = pool.run(lambda ftp: fetchListing(ftp, useMlsd), path)
+        if listings:
+            listings.put(path, entries)
+        with lock:
+            for entry in entries:
+                child = posixpath.join(relative, entry.name) if relative else entry.name
+                if entry.isDir:
+                    dirs.add(child)
+                    submit(child)
+                else:
+                    files[child] = entry
+
+    failures = runBounded([''], visit, workers)
+    return files, dirs, failures
+
+
+def walkLocal(root):
+    files = {}
+    dirs = set()
+    for path, dirNames, fileNames in os.walk(root):
+        relative = os.path.relpath(path, root).replace(os.sep, '/')
+        relative = '' if relative == '.' else relative
+        for name in dirNames:
+            dirs.add(posixpath.join(relative, name) if relative else name)
+        for name in fileNames:
+            if not resumableTransfer.isStateFile(name):
+                files[posixpath.join(relative, name) if relative else name] = os.path.join(path, name)
+    return files, dirs
+
+
+# copy the remote tree remoteRoot into localRoot, only downloading files that changed
+def mirror(pool, remoteRoot, localRoot, job, workers=WORKERS, listings=None):
+    files, dirs, failures = crawlRemote(pool, remoteRoot, workers, listings)
+    if failures and not files and not dirs:
+        raise failures[0][1]                                                # couldn't even list the root
+    os.makedirs(localRoot, exist_ok=True)
+    for relative in dirs:
+        os.makedirs(os.path.join(localRoot, *relative.split('/')), exist_ok=True)
+    counts = {'transferred': 0, 'unchanged': 0}
+    countLock = threading.Lock()
+    progressLock = threading.Lock()
+
+    def sync(relative, submit):
+        entry = files[relative]
+        directory = posixpath.dirname(posixpath.join(remoteRoot, relative))
+        localPath = os.path.join(localRoot, *relative.split('/'))
+        unchanged, remoteTime = decide(downloadUnchanged(localPath, entry), answerer(pool, directory, entry.name, localPath))
+        if unchanged:
+            with countLock:
+                counts['unchanged'] += 1
+            return
+        resumableTransfer.download(lambda: pool.lease(directory), entry.name, localPath, FileProgress(job, progressLock))
+        if remoteTime is None:
+            remoteTime = pool.run(lambda ftp: mdtmTime(ftp, entry.name), directory)
+        if remoteTime is not None:
+            os.utime(localPath, (remoteTime, remoteTime))
+        with countLock:
+            counts['transferred'] += 1
+
+    failures += runBounded(sorted(files), sync, workers)
+    counts['failed'] = failures
+    return counts
+
+
+# copy the local tree localRoot up to remoteRoot, only uploading files that changed
+def reverseMirror(pool, localRoot, remoteRoot, job, workers=WORKERS, listings=None):
+    if not os.path.isdir(localRoot):
+        raise FileNotFoundError(localRoot)
+    try:
+        pool.run(lambda ftp: None, remoteRoot)                              # leasing into it fails if it's missing
+    except ftplib.error_perm:
+        pool.run(lambda ftp: ftp.mkd(remoteRoot))
+        if listings:
+            listings.update(posixpath.dirname(remoteRoot), posixpath.basename(remoteRoot), True)
+    remoteFiles, remoteDirs, failures = crawlRemote(pool, remoteRoot, workers, listings)
+    localFiles, localDirs = walkLocal(localRoot)
+
+    # parents sort before their children, so each directory is made after the one it goes in
+    with pool.lease() as ftp:
+        for relative in sorted(localDirs - remoteDirs):
+            try:
+                ftp.mkd(posixpath.join(remoteRoot, relative))
+            except ftplib.error_perm as e:
+                failures.append((relative, e))
+                continue
+            if listings:
+                listings.update(remoteRoot, relative, True)
+
+    counts = {'transferred': 0, 'unchanged': 0}
+    countLock = threading.Lock()
+    progressLock = threading.Lock()
+    canSetTime = 'MFMT' in pool.features
+
+    def sync(relative, submit):
+        localPath = localFiles[relative]
+        info = os.stat(localPath)
+        directory, name = posixpath.split(posixpath.join(remoteRoot, relative))
+        if decide(uploadUnchanged(info, remoteFiles.get(relative)), answerer(pool, directory, name, localPath)):
+            with countLock:
+                counts['unchanged'] += 1
+            return
+        resumableTransfer.upload(lambda: pool.lease(directory), localPath, name, FileProgress(job, progressLock))
+        if listings:
+            listings.update(directory, name, False, info.st_size)
+        if canSetTime:
+            stamp = time.strftime('%Y%m%d%H%M%S', time.gmtime(info.st_mtime))
+            try:
+                pool.run(lambda ftp: ftp.sendcmd('MFMT %s %s' % (stamp, name)), directory)
+            except ftplib.error_perm:
+                pass
+        with countLock:
+            counts['transferred'] += 1
+
+    failures += runBounded(sorted(localFiles), sync, workers)
+    counts['failed'] = failures
+    return counts
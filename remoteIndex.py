@@ -0,0 +1,236 @@
+# Persistent index of the remote tree (path, type, size, modification time) kept in SQLite, so
+# find can search the whole server and op can find a file it already knows about without asking.
+# Every listing the client fetches lands in the index (ListingCache passes its changes on), and
+# IndexCrawler fills in the rest in the background: directories it has never listed first, then
+# the ones listed longest ago, so the index is refreshed a directory at a time. Writes happen on a
+# thread of their own so a big listing reaches the window without waiting for SQLite.
+
+import ftplib
+import os
+import posixpath
+import queue
+import sqlite3
+import threading
+import time
+
+from listingCache import fetchListing
+from listParser import ListEntry
+
+INDEX_PATH = os.path.join(os.path.expanduser('~'), '.ftp-client-index.sqlite')
+REFRESH = 600                           # seconds before the crawler lists a directory again
+PAUSE = 0.5                             # seconds between the crawler's listings, to leave the server to the user
+FIND_LIMIT = 1000                       # matches returned by find
+DOT_NAMES = ('.', '..')                 # names that don't lead anywhere new; see plainPath
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (site TEXT, path TEXT, parent TEXT, name TEXT, isDir INTEGER,
+                                    size INTEGER, modified TEXT, PRIMARY KEY (site, path));
+CREATE INDEX IF NOT EXISTS entriesByParent ON entries (site, parent);
+CREATE TABLE IF NOT EXISTS dirs (site TEXT, path TEXT, listed REAL, PRIMARY KEY (site, path));
+'''
+
+
+def under(root):
+    return root.rstrip('/') + '/'
+
+
+# whether path has no '.' or '..' components. A listing that passes those on as directories would
+# have the crawler go round in circles (/x/., /x/./.) or climb out of its root (/x/..)
+def plainPath(path):
+    return not any(part in DOT_NAMES for part in path.split('/'))
+
+
+# the index of site kept at path, as (RemoteIndex, None), or (None, why) if the file can't be opened;
+# the index is optional, so the client carries on without it
+def openIndex(site, path=INDEX_PATH):
+    try:
+        return RemoteIndex(site, path), None
+    except sqlite3.Error as e:
+        return None, str(e)
+
+
+class RemoteIndex:
+
+    def __init__(self, site, path=INDEX_PATH):
+        self.site = site                                # 'user@host:port', so one file can hold several servers
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        try:
+            self.db.execute('PRAGMA journal_mode=WAL')  # the window and a script can share the file
+            self.db.executescript(SCHEMA)
+        except sqlite3.Error:                           # locked or not a database: don't keep it open
+            self.db.close()
+            raise
+        self.writes = queue.Queue()                     # (function, args) for the writer thread
+        self.digests = {}                               # path -> hash of the listing last written for it
+        threading.Thread(target=self.writer, daemon=True).start()
+
+    def writer(self):
+        while True:
+            func, args = self.writes.get()
+            try:
+                with self.lock, self.db:
+                    func(*args)
+            except sqlite3.Error:
+                pass                                    # only a copy of the server's state; the crawler lists it again
+            finally:
+                self.writes.task_done()
+
+    def close(self):
+        self.writes.join()
+        with self.lock:
+            self.db.close()
+
+    # ----- kept in step with ListingCache -----
+
+    # replace what is known about directory with a fresh listing of it
+    def put(self, path, entries):
+        if not plainPath(path):
+            return
+        rows = [(entry.name, int(entry.isDir), entry.size, entry.modified) for entry in entries
+                if entry.name not in DOT_NAMES]
+        self.writes.put((self.putListing, (path, rows)))
+
+    # add or replace one entry after a put or mkdir
+    def update(self, directory, name, isDir, size=0):
+        path = posixpath.normpath(posixpath.join(directory, name))
+        self.writes.put((self.putEntry, (path, int(isDir), size, time.strftime('%Y%m%d%H%M%S', time.gmtime()))))
+
+    # drop one entry after a delete or rmdir, along with everything below it
+    def remove(self, directory, name):
+        self.writes.put((self.deleteEntry, (posixpath.normpath(posixpath.join(directory, name)),)))
+
+    # drop the entry at exactly path, without normalising it, e.g. /x/. left by an older client
+    def forget(self, path):
+        self.writes.put((self.deleteEntry, (path,)))
+
+    def rename(self, directory, oldName, newName):
+        self.writes.put((self.moveEntry, (posixpath.normpath(posixpath.join(directory, oldName)),
+                                          posixpath.normpath(posixpath.join(directory, newName)))))
+
+    # ----- writer thread, with the lock held inside a transaction -----
+
+    # only rows that changed are written, and a listing identical to the last one written for the
+    # directory just renews its time
+    def putListing(self, path, rows):
+        digest = hash(tuple(rows))
+        if self.digests.get(path) != digest:
+            self.diffListing(path, rows)
+            self.digests[path] = digest
+        self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (self.site, path, time.time()))
+
+    def diffListing(self, path, rows):
+        known = set(self.db.execute('SELECT name, isDir, size, modified FROM entries WHERE site = ? AND parent = ?',
+                                    (self.site, path)))
+        rows = set(rows)
+        changed = {row[0]: row for row in rows - known}
+        for name, wasDir, size, modified in known - rows:
+            if name not in changed:
+                self.deleteEntry(posixpath.join(path, name))
+            elif wasDir and not changed[name][1]:
+                self.deleteBelow(posixpath.join(path, name))
+        self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            ((self.site, posixpath.join(path, row[0]), path) + row for row in changed.values()))
+
+    def putEntry(self, path, isDir, size, modified):
+        self.digests.pop(posixpath.dirname(path), None)
+        self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (self.site, path, posixpath.dirname(path), posixpath.basename(path), isDir, size, modified))
+
+    def moveEntry(self, oldPath, newPath):
+        moved = self.db.execute('SELECT path, isDir, size, modified FROM entries WHERE site = ? AND '
+                                '(path = ? OR substr(path, 1, ?) = ?)',
+                                (self.site, oldPath, len(under(oldPath)), under(oldPath))).fetchall()
+        self.deleteEntry(oldPath)
+        self.deleteEntry(newPath)
+        for path, isDir, size, modified in moved:
+            self.putEntry(newPath + path[len(oldPath):], isDir, size, modified)
+
+    def deleteEntry(self, path):
+        self.digests.pop(posixpath.dirname(path), None)
+        self.db.execute('DELETE FROM entries WHERE site = ? AND path = ?', (self.site, path))
+        self.deleteBelow(path)
+
+    def deleteBelow(self, path):
+        prefix = under(path)
+        for cached in [cached for cached in self.digests if cached == path or cached.startswith(prefix)]:
+            del self.digests[cached]
+        self.db.execute('DELETE FROM entries WHERE site = ? AND substr(path, 1, ?) = ?', (self.site, len(prefix), prefix))
+        self.db.execute('DELETE FROM dirs WHERE site = ? AND (path = ? OR substr(path, 1, ?) = ?)',
+                        (self.site, path, len(prefix), prefix))
+
+    # ----- lookups, each made after the writes queued before it -----
+
+    # the entry for name in directory, None if the index doesn't have it
+    def entry(self, directory, name):
+        path = posixpath.normpath(posixpath.join(directory, name))
+        self.writes.join()
+        with self.lock:
+            row = self.db.execute('SELECT name, isDir, size, modified FROM entries WHERE site = ? AND path = ?',
+                                  (self.site, path)).fetchone()
+        return None if row is None else ListEntry(row[0], bool(row[1]), row[2], row[3])
+
+    # entries below root whose name (or path relative to root, if the pattern has a /) matches a glob
+    # pattern, or contains the text if it has no wildcards; named by their path relative to root
+    def find(self, pattern, root):
+        if not any(char in pattern for char in '*?['):
+            pattern = '*' + pattern + '*'
+        prefix = under(root)
+        column = 'substr(path, %d)' % (len(prefix) + 1) if '/' in pattern else 'name'    # a/b/*.c matches relative paths
+        self.writes.join()
+        with self.lock:
+            rows = self.db.execute('SELECT path, isDir, size, modified FROM entries WHERE site = ? AND '
+                                   'substr(path, 1, ?) = ? AND ' + column + ' GLOB ? ORDER BY path LIMIT ?',
+                                   (self.site, len(prefix), prefix, pattern, FIND_LIMIT)).fetchall()
+        return [ListEntry(path[len(prefix):], bool(isDir), size, modified) for path, isDir, size, modified in rows]
+
+    # next directory under root for the crawler: root itself, then directories never listed, then the
+    # one listed longest ago if that was more than `refresh` seconds back; None when all are fresh
+    def nextDirectory(self, root, refresh):
+        prefix = under(root)
+        self.writes.join()
+        with self.lock:
+            if self.db.execute('SELECT 1 FROM dirs WHERE site = ? AND path = ?', (self.site, root)).fetchone() is None:
+                return root
+            row = self.db.execute('SELECT e.path FROM entries e LEFT JOIN dirs d ON d.site = e.site AND d.path = e.path '
+                                  'WHERE e.site = ? AND e.isDir AND d.path IS NULL AND substr(e.path, 1, ?) = ? LIMIT 1',
+                                  (self.site, len(prefix), prefix)).fetchone()
+            if row is None:
+                row = self.db.execute('SELECT path FROM dirs WHERE site = ? AND listed < ? AND (path = ? OR substr(path, 1, ?) = ?) '
+                                      'ORDER BY listed LIMIT 1',
+                                      (self.site, time.time() - refresh, root, len(prefix), prefix)).fetchone()
+        return None if row is None else row[0]
+
+
+# background thread that keeps the index of everything under root filled in and fresh, one listing at
+# a time over the client's own pool. It stops once the pool is closed
+class IndexCrawler:
+
+    def __init__(self, index, pool, root, refresh=REFRESH, pause=PAUSE):
+        self.index = index
+        self.pool = pool
+        self.root = root
+        self.refresh = refresh
+        self.pause = pause
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.pool.closed:
+            directory = self.index.nextDirectory(self.root, self.refresh)
+            if directory is None:
+                time.sleep(self.refresh / 10)
+                continue
+            if not plainPath(directory):                # left by an older client; never list it
+                self.index.forget(directory)
+                continue
+            try:
+                entries = self.pool.run(lambda ftp: fetchListing(ftp, 'MLST' in self.pool.features), directory)
+                self.index.put(directory, entries)
+            except ftplib.error_perm:                   # gone or not readable: forget it rather than retry forever
+                parent, name = posixpath.split(directory)
+                self.index.remove(parent, name)
+                if directory == self.root:
+                    return
+            except Exception:
+                time.sleep(self.refresh / 10)          # dropped connection or closed pool; the loop condition decides
+            time.sleep(self.pause)
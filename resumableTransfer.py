@@ -0,0 +1,278 @@
+# Resumable downloads and uploads. Downloads restart with REST <bytes already on disk> and append;
+# uploads ask the server how much it has with SIZE and continue with APPE (or REST + STOR). Dropped
+# connections and temporary (4xx) errors are retried with exponential backoff, and a small sidecar
+# state file next to the local file lets an interrupted transfer pick up from its last confirmed
+# offset even after the client has been restarted. Files of VERIFY_MIN bytes or more are checksummed
+# as they stream and checked against the server's HASH/XCRC/XMD5; a mismatch starts them over.
+
+import ftplib
+import json
+import os
+import time
+
+import checksums
+import dataPath
+from connectionPool import dropped
+
+STATE_SUFFIX = '.ftpresume'
+RETRIES = 5
+BACKOFF = 2                             # seconds before the first retry, doubled after each failure
+BACKOFF_MAX = 60
+CHECKPOINT = 8 * 1048576                # bytes between sidecar updates
+VERIFY_MIN = 1048576                    # smaller files aren't worth the extra checksum round trip
+
+
+def statePath(localName):
+    return localName + STATE_SUFFIX
+
+
+# whether a local file is a sidecar (or one being written), which batch and mirror uploads leave out
+def isStateFile(path):
+    return path.endswith(STATE_SUFFIX) or path.endswith(STATE_SUFFIX + '.tmp')
+
+
+def loadState(localName):
+    try:
+        with open(statePath(localName)) as stateFile:
+            return json.load(stateFile)
+    except (OSError, ValueError):
+        return None
+
+
+def saveState(localName, state):
+    temporary = statePath(localName) + '.tmp'
+    with open(temporary, 'w') as stateFile:
+        json.dump(state, stateFile)
+    os.replace(temporary, statePath(localName))     # never leave a half-written sidecar behind
+
+
+def clearState(localName):
+    try:
+        os.remove(statePath(localName))
+    except FileNotFoundError:
+        pass
+
+
+# what a sidecar has to match before a transfer may pick up where it says the last one stopped.
+# Shared with asyncEngine, so either engine can resume what the other started
+def downloadIdentity(remoteName, size, modified):
+    return {'direction': 'get', 'remote': remoteName, 'size': size, 'modified': modified}
+
+
+def uploadIdentity(remoteName, info):
+    return {'direction': 'put', 'remote': remoteName, 'size': info.st_size, 'modified': int(info.st_mtime)}
+
+
+# the sidecar next to localName if it was written for this same transfer, else None
+def sameTransfer(localName, identity):
+    state = loadState(localName)
+    if state and all(state.get(key) == value for key, value in identity.items()):
+        return state
+    return None
+
+
+# bytes of localName a download can keep: what the sidecar confirmed, if it is for the same remote file
+def downloadOffset(localName, identity):
+    state = sameTransfer(localName, identity)
+    if state is None or identity['size'] is None or not os.path.exists(localName):
+        return 0
+    return min(state.get('offset', 0), os.path.getsize(localName))
+
+
+def remoteModified(ftp, remoteName):
+    try:
+        return ftp.sendcmd('MDTM ' + remoteName)[4:].strip()
+    except ftplib.error_perm:
+        return None
+
+
+def remoteSize(ftp, remoteName):
+    try:
+        return ftp.size(remoteName)
+    except ftplib.error_perm:
+        return None
+
+
+# read off the reply to a transfer we stopped early so the session can be reused. Only when one is
+# owed: a command the server refused has already had its reply read
+def discardReply(ftp):
+    if not getattr(ftp, 'replyPending', False):
+        return
+    try:
+        ftp.voidresp()
+    except ftplib.all_errors:
+        pass
+
+
+def retryable(error):
+    return dropped(error) or isinstance(error, (ftplib.error_temp, ftplib.error_reply))
+
+
+# seconds to wait after failed try number `tries` (counting from 0)
+def backoff(tries):
+    return min(BACKOFF * 2 ** tries, BACKOFF_MAX)
+
+
+# run attempt() until it succeeds, backing off between retryable failures. job.progress(0) is used
+# as the sleep tick so a pause or cancel still gets through while we wait
+def withRetries(job, attempt, retries):
+    for tries in range(retries + 1):
+        try:
+            return attempt()
+        except Exception as e:
+            if tries == retries or not retryable(e):
+                raise
+        delay = backoff(tries)
+        until = time.monotonic() + delay
+        while time.monotonic() < until:
+            job.progress(0)
+            time.sleep(min(0.2, delay))
+
+
+# the checksum to stream a transfer of size bytes through, or (None, None) if it won't be verified
+def streamDigest(ftp, size):
+    if not dataPath.verify or size is None or size < VERIFY_MIN:
+        return None, None
+    algorithm = checksums.transferAlgorithm(ftp, getattr(ftp, 'features', {}))
+    return algorithm, algorithm and checksums.newDigest(algorithm)
+
+
+# download remoteName into localName, continuing a previous partial download if the sidecar says
+# the remote file hasn't changed since. lease() must return a context manager giving a session
+# in the right remote directory. Returns the checksum algorithm it was verified with, if any
+def download(lease, remoteName, localName, job, retries=RETRIES):
+
+    def attempt():
+        with lease() as ftp:
+            dataPath.binaryMode(ftp)
+            size = remoteSize(ftp, remoteName)
+            modified = remoteModified(ftp, remoteName)
+            identity = downloadIdentity(remoteName, size, modified)
+            offset = downloadOffset(localName, identity)
+            job.total = size
+            job.done = offset
+            if offset and size is not None and offset >= size:       # only what the sidecar vouches for counts as done
+                clearState(localName)
+                return
+            algorithm, digest = streamDigest(ftp, size)
+            if digest and offset:
+                with open(localName, 'rb') as partFile:
+                    checksums.updateFromFile(digest, partFile, offset)
+            position = [offset, offset]             # bytes written, bytes confirmed in the sidecar
+            opened = []                             # the local file, once the server has accepted RETR
+
+            # only touch the local file and sidecar once RETR gets its 1xx reply, so a name the
+            # server refuses (a typo, a missing file) leaves nothing behind or truncated
+            def accepted():
+                localFile = open(localName, 'r+b' if offset else 'wb')
+                opened.append(localFile)
+                saveState(localName, dict(identity, offset=offset))
+                localFile.truncate(offset)
+                localFile.seek(offset)
+                return localFile
+
+            def received(nbytes):
+                position[0] += nbytes
+                if position[0] - position[1] >= CHECKPOINT:
+                    opened[0].flush()
+                    os.fsync(opened[0].fileno())
+                    position[1] = position[0]
+                    saveState(localName, dict(identity, offset=position[1]))
+                job.progress(nbytes)
+
+            try:
+                dataPath.retrieve(ftp, 'RETR ' + remoteName, accepted, received, rest=offset or None, digest=digest)
+            except BaseException as e:
+                if opened:
+                    opened[0].flush()                   # keep what arrived so the next try starts from there
+                    saveState(localName, dict(identity, offset=position[0]))
+                if not (isinstance(e, Exception) and dropped(e)):
+                    discardReply(ftp)                   # cancelled or failed locally: the session is still fine
+                raise
+            finally:
+                if opened:
+                    opened[0].close()
+            if digest and not verifyTransfer(ftp, remoteName, algorithm, digest, localName, True):
+                algorithm = None
+        clearState(localName)
+        return algorithm
+
+    return withRetries(job, attempt, retries)
+
+
+# check a finished transfer against the server's checksum; on a mismatch drop the sidecar (and a
+# downloaded copy) so the retry starts from the beginning. Returns whether the server could tell
+def verifyTransfer(ftp, remoteName, algorithm, digest, localName, downloaded):
+    try:
+        return checksums.verify(ftp, remoteName, getattr(ftp, 'features', {}), algorithm, digest)
+    except checksums.ChecksumMismatch:
+        discardMismatch(localName, downloaded)
+        raise
+
+
+def discardMismatch(localName, downloaded):
+    clearState(localName)
+    if downloaded:
+        os.remove(localName)
+
+
+# upload localName as remoteName, continuing from however much of it the server already has if the
+# sidecar shows an earlier upload of this same local file. Returns the checksum algorithm it was
+# verified with, if any
+def upload(lease, localName, remoteName, job, retries=RETRIES):
+
+    def attempt():
+        with open(localName, 'rb') as localFile:
+            info = os.fstat(localFile.fileno())
+            identity = uploadIdentity(remoteName, info)
+            job.total = info.st_size
+            with lease() as ftp:
+                dataPath.binaryMode(ftp)
+                offset = 0
+                if sameTransfer(localName, identity):
+                    offset = remoteSize(ftp, remoteName) or 0
+                    if offset > info.st_size:
+                        offset = 0
+                job.done = offset
+                if offset and offset == info.st_size:
+                    clearState(localName)
+                    return
+                algorithm, digest = streamDigest(ftp, info.st_size)
+                if digest and offset:
+                    checksums.updateFromFile(digest, localFile, offset)
+                localFile.seek(offset)
+                position = [offset, offset]
+
+                # write the sidecar only once STOR/APPE gets its 1xx reply, so an upload the server
+                # refuses (no such remote directory, no permission) leaves nothing next to the file
+                def accepted():
+                    saveState(localName, dict(identity, offset=offset))
+
+                def sent(nbytes):
+                    position[0] += nbytes
+                    if position[0] - position[1] >= CHECKPOINT:
+                        position[1] = position[0]
+                        saveState(localName, dict(identity, offset=position[1]))
+                    job.progress(nbytes)
+
+                try:
+                    if offset == 0:
+                        dataPath.store(ftp, 'STOR ' + remoteName, localFile, sent, digest=digest, accepted=accepted)
+                    else:
+                        try:
+                            dataPath.store(ftp, 'APPE ' + remoteName, localFile, sent, digest=digest, accepted=accepted)
+                        except ftplib.error_perm as e:
+                            if not str(e).startswith('50'):     # APPE not implemented: fall back to REST + STOR
+                                raise
+                            dataPath.store(ftp, 'STOR ' + remoteName, localFile, sent, rest=offset, digest=digest,
+                                           accepted=accepted)
+                except BaseException as e:
+                    if not (isinstance(e, Exception) and dropped(e)):
+                        discardReply(ftp)               # cancelled or failed locally: let the server finish what it has
+                    raise
+                if digest and not verifyTransfer(ftp, remoteName, algorithm, digest, localName, False):
+                    algorithm = None
+        clearState(localName)
+        return algorithm
+
+    return withRetries(job, attempt, retries)
@@ -0,0 +1,121 @@
+# Segmented download of one large file over several FTP sessions at once. Each session asks for its
+# own byte range with REST + RETR and writes it straight into its place in a preallocated local file,
+# which only gets its real name once every segment has arrived.
+
+import ftplib
+import os
+import socket
+import threading
+
+import dataPath
+
+SEGMENTS = 4                            # extra logins opened per download
+MIN_SEGMENT = 4 * 1048576               # don't bother splitting below this many bytes per segment
+BLOCKSIZE = 262144
+
+
+# preallocate the whole file up front so segments can write anywhere in it. Segments always start
+# over, so a .part left by an earlier (maybe larger) download is truncated first: fallocate never
+# shrinks a file and its old tail would end up in the result
+def preallocate(path, size):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+    except OSError:
+        os.ftruncate(fd, size)
+    return fd
+
+
+# positional write; Windows has no os.pwrite so fall back to seek + write on a per-segment handle
+def writeAt(fd, handle, data, offset):
+    if handle is None:
+        os.pwrite(fd, data, offset)
+    else:
+        handle.seek(offset)
+        handle.write(data)
+
+
+# byte ranges [start, end) covering the whole file
+def splitRanges(size, segments):
+    segments = max(1, min(segments, size // MIN_SEGMENT))
+    step = size // segments
+    return [(i * step, size if i == segments - 1 else (i + 1) * step) for i in range(segments)]
+
+
+def fetchSegment(session, remotePath, fd, path, start, end, report, stop):
+    handle = None if hasattr(os, 'pwrite') else open(path, 'r+b')
+    try:
+        dataPath.binaryMode(session)
+        dataPath.transferMode(session, 'S')                     # segments start with REST
+        view = dataPath.blockBuffer(max(BLOCKSIZE, dataPath.link.blocksize()))
+        conn = session.transfercmd('RETR ' + remotePath, rest=start)
+        offset = start
+        with conn:
+            dataPath.tuneSocket(conn, socket.SO_RCVBUF)
+            while offset < end and not stop.is_set():
+                count = conn.recv_into(view, min(len(view), end - offset))
+                if not count:
+                    break
+                writeAt(fd, handle, view[:count], offset)
+                offset += count
+                report(count)
+        if offset < end and not stop.is_set():
+            raise ftplib.error_proto('segment %d-%d ended early at %d' % (start, end, offset))
+        try:
+            session.voidresp()          # 226 for the last segment, 426/451 for ones we cut short
+        except ftplib.all_errors:
+            pass
+    finally:
+        if handle:
+            handle.close()
+
+
+# download remotePath (absolute, since new sessions start in the home directory) into localName.
+# login() must return a fresh logged-in ftplib.FTP; progress(nbytes) is called from one thread at a time
+# and may raise to abort the whole download
+def segmentedDownload(login, remotePath, localName, size, segments=SEGMENTS, progress=None):
+    partName = localName + '.part'
+    ranges = splitRanges(size, segments)
+    sessions = []
+    stop = threading.Event()
+    reportLock = threading.Lock()
+    errors = []
+
+    def report(nbytes):
+        if progress:
+            with reportLock:
+                progress(nbytes)
+
+    def run(session, start, end):
+        try:
+            fetchSegment(session, remotePath, fd, partName, start, end, report, stop)
+        except BaseException as e:      # includes cancellation raised by progress()
+            errors.append(e)
+            stop.set()
+
+    fd = preallocate(partName, size)
+    try:
+        for _ in ranges:
+            sessions.append(login())
+        threads = [threading.Thread(target=run, args=(session, start, end), daemon=True)
+                   for session, (start, end) in zip(sessions, ranges)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        os.close(fd)
+        for session in sessions:
+            try:
+                session.quit()
+            except ftplib.all_errors:
+                session.close()
+    if errors:
+        os.remove(partName)
+        raise errors[0]
+    os.replace(partName, localName)     # only now does the finished file appear under its real name
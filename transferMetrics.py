@@ -0,0 +1,124 @@
+# Instrumentation for the client's FTP traffic. MeteredFTP times every control command from send to
+# final reply and every data connection from PASV/PORT to the server's 1xx, and the command engine
+# logs each finished command with its bytes, rate and stall time. Everything lands in one shared
+# Metrics object that the metrics panel reads and that can be exported as JSON (all counters) or
+# CSV (the per-command log) to compare servers or spot regressions.
+
+import collections
+import csv
+import json
+import threading
+import time
+
+from connectionPool import PooledFTP
+
+SAMPLES = 500                           # recent timings kept per counter for the percentiles
+LOG_SIZE = 1000                         # finished commands kept in the log
+
+
+# value at percent (0-100) of an already sorted list, nearest-rank; None if it's empty
+def percentile(ordered, percent):
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+# count/mean/max of everything seen, percentiles over the last SAMPLES timings
+class Timings:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.recent = collections.deque(maxlen=SAMPLES)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.worst = max(self.worst, seconds)
+        self.recent.append(seconds)
+
+    def summary(self):
+        ordered = sorted(self.recent)
+        return {'count': self.count, 'mean': self.total / self.count if self.count else None,
+                'p50': percentile(ordered, 50), 'p95': percentile(ordered, 95), 'max': self.worst}
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.control = {}                       # command verb -> Timings of its round trips
+            self.dataSetup = Timings()              # PASV/PORT + transfer command until the 1xx reply
+            self.log = collections.deque(maxlen=LOG_SIZE)
+
+    def controlReply(self, verb, seconds):
+        with self.lock:
+            if verb not in self.control:
+                self.control[verb] = Timings()
+            self.control[verb].add(seconds)
+
+    def dataConnection(self, seconds):
+        with self.lock:
+            self.dataSetup.add(seconds)
+
+    # log a finished command; outcome is ok, error, failed or cancelled. Returns the log record
+    def commandDone(self, command, outcome, seconds, nbytes=0, stalled=0.0):
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'command': command,
+                  'outcome': outcome, 'seconds': round(seconds, 3), 'bytes': nbytes,
+                  'bytesPerSecond': round(nbytes / seconds) if nbytes and seconds else None,
+                  'stalled': round(stalled, 3)}
+        with self.lock:
+            self.log.append(record)
+        return record
+
+    def snapshot(self):
+        with self.lock:
+            return {'control': {verb: timings.summary() for verb, timings in sorted(self.control.items())},
+                    'dataSetup': self.dataSetup.summary(),
+                    'commands': list(self.log)}
+
+    # .csv gets the per-command log, anything else a JSON snapshot of every counter
+    def export(self, path):
+        snapshot = self.snapshot()
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='') as logFile:
+                writer = csv.DictWriter(logFile, ['time', 'command', 'outcome', 'seconds', 'bytes', 'bytesPerSecond', 'stalled'])
+                writer.writeheader()
+                writer.writerows(snapshot['commands'])
+        else:
+            with open(path, 'w') as logFile:
+                json.dump(snapshot, logFile, indent=2)
+
+
+metrics = Metrics()                     # shared by every session the client opens
+
+
+# ftplib.FTP that reports its control round trips and data connection setup times to metrics.
+# sendcmd and voidcmd cover every command ftplib sends and waits for (size, cwd, login, TYPE, ...)
+class MeteredFTP(PooledFTP):
+
+    def sendcmd(self, cmd):
+        started = time.perf_counter()
+        try:
+            return super().sendcmd(cmd)
+        finally:
+            metrics.controlReply(cmd.split(' ', 1)[0].upper(), time.perf_counter() - started)
+
+    def voidcmd(self, cmd):                     # ftplib's doesn't go through sendcmd
+        started = time.perf_counter()
+        try:
+            return super().voidcmd(cmd)
+        finally:
+            metrics.controlReply(cmd.split(' ', 1)[0].upper(), time.perf_counter() - started)
+
+    def ntransfercmd(self, cmd, rest=None):
+        started = time.perf_counter()
+        result = super().ntransfercmd(cmd, rest)
+        metrics.dataConnection(time.perf_counter() - started)
+        return result
@@ -0,0 +1,234 @@
+# Background transfer engine for the FTP client. Commands are queued as jobs and run on a small
+# pool of worker threads so long transfers never block the Tk mainloop. Workers never touch the
+# UI: finished jobs are posted to an event queue that the UI drains from the main thread, and
+# progress is read straight off the job objects. runBounded spreads the files of one batch job
+# (mirror, mget, ...) over a few threads of its own.
+
+import collections
+import itertools
+import queue
+import threading
+import time
+
+STALL = 1.0                             # seconds without a block before the wait counts as a stall
+RATE_WINDOW = 3.0                       # seconds of progress the live rate is averaged over
+
+
+# BaseException so the catch-all "except Exception" blocks in the command handlers don't swallow a
+# cancellation (same reasoning as asyncio.CancelledError)
+class JobCancelled(BaseException):
+    pass
+
+
+class Job:
+
+    def __init__(self, jobId, name, func, args, total, exclusive):
+        self.id = jobId
+        self.name = name                        # text shown in the status bar, e.g. 'get big.iso'
+        self.func = func
+        self.args = args
+        self.total = total                      # expected size in bytes, None if unknown
+        self.done = 0                           # bytes transferred so far, counting what a resumed transfer already had
+        self.moved = 0                          # bytes actually moved by this job, what metrics and rates are based on
+        self.stalled = 0.0                      # seconds lost to gaps of more than STALL between blocks
+        self.lastBlock = None                   # time.monotonic() of the latest block
+        self.samples = collections.deque(maxlen=int(RATE_WINDOW * 4))     # (time, done), 4 a second
+        self.exclusive = exclusive              # runs alone, after everything queued before it
+        self.state = 'queued'                   # queued, running, paused, done, failed, cancelled
+        self.result = None
+        self.error = None
+        self.listing = None                     # (heading, entries) to show instead of the directory, e.g. find results
+        self.cancelled = threading.Event()
+        self.unpaused = threading.Event()       # cleared while the job is paused
+        self.unpaused.set()
+
+    def percent(self):
+        if not self.total:
+            return None
+        return min(100, self.done * 100 // self.total)
+
+    # bytes per second over the last RATE_WINDOW seconds, None until there is enough to tell
+    def rate(self):
+        samples = list(self.samples)
+        if len(samples) < 2:
+            return None
+        now = time.monotonic()
+        if now - samples[-1][0] > RATE_WINDOW:
+            return 0.0
+        return (self.done - samples[0][1]) / (now - samples[0][0])
+
+    # called by the worker function for every block moved; blocks while paused and aborts if cancelled
+    def progress(self, nbytes):
+        self.done += nbytes
+        self.moved += nbytes
+        if nbytes:
+            now = time.monotonic()
+            if self.lastBlock is not None and now - self.lastBlock > STALL:
+                self.stalled += now - self.lastBlock
+            self.lastBlock = now
+            if not self.samples or now - self.samples[-1][0] >= 0.25:
+                self.samples.append((now, self.done))
+        self.checkpoint()
+
+    def checkpoint(self):
+        if not self.unpaused.is_set():
+            self.state = 'paused'
+            self.unpaused.wait()
+            self.state = 'running'
+            if self.lastBlock is not None:
+                self.lastBlock = time.monotonic()       # time spent paused isn't a stall
+                self.samples.clear()
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.unpaused.set()                     # wake up a paused job so it can exit
+
+    def pause(self):
+        self.unpaused.clear()
+
+    def resume(self):
+        self.unpaused.set()
+
+
+class TransferQueue:
+
+    def __init__(self, workers=2):
+        self.pending = collections.deque()
+        self.cond = threading.Condition()
+        self.running = 0
+        self.exclusiveRunning = False
+        self.stopping = False
+        self.events = queue.Queue()             # (state, job) tuples for the UI thread
+        self.active = {}                        # job id -> job, for everything not yet finished
+        self.ids = itertools.count(1)
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # queue func(job, *args) to run on a worker thread and return the job handle
+    def submit(self, name, func, *args, total=None, exclusive=False):
+        job = Job(next(self.ids), name, func, args, total, exclusive)
+        with self.cond:
+            self.active[job.id] = job
+            self.pending.append(job)
+            self.cond.notify_all()
+        return job
+
+    # jobs start in submission order; an exclusive job waits for the pool to drain and holds back
+    # everything queued after it until it finishes
+    def nextJob(self):
+        with self.cond:
+            while True:
+                if self.stopping:
+                    return None
+                if self.pending and not self.exclusiveRunning:
+                    job = self.pending[0]
+                    if not job.exclusive or self.running == 0:
+                        self.pending.popleft()
+                        self.running += 1
+                        self.exclusiveRunning = job.exclusive
+                        return job
+                self.cond.wait()
+
+    def worker(self):
+        while True:
+            job = self.nextJob()
+            if job is None:
+                return
+            try:
+                if job.cancelled.is_set():
+                    raise JobCancelled()
+                job.state = 'running'
+                job.result = job.func(job, *job.args)
+                job.state = 'done'
+            except JobCancelled:
+                job.state = 'cancelled'
+            except Exception as e:
+                job.error = e
+                job.state = 'failed'
+            with self.cond:
+                self.running -= 1
+                if job.exclusive:
+                    self.exclusiveRunning = False
+                self.active.pop(job.id, None)
+                self.cond.notify_all()
+            self.events.put((job.state, job))
+
+    def get(self, jobId):
+        with self.cond:
+            return self.active.get(jobId)
+
+    def list(self):
+        with self.cond:
+            return sorted(self.active.values(), key=lambda job: job.id)
+
+    # drain every finished-job event without blocking; meant to be called from a root.after loop
+    def poll(self):
+        finished = []
+        while True:
+            try:
+                finished.append(self.events.get_nowait())
+            except queue.Empty:
+                return finished
+
+    def shutdown(self):
+        for job in self.list():
+            job.cancel()
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+
+
+# stands in for a job in resumableTransfer so every file of a batch feeds the batch job's progress
+class FileProgress:
+
+    def __init__(self, job, lock):
+        self.job = job
+        self.lock = lock
+        self.total = None
+        self.done = 0
+
+    def progress(self, nbytes):
+        with self.lock:
+            self.job.progress(nbytes)
+
+
+# run func(item, submit) for every item on at most `workers` threads; func may submit() more items.
+# Returns [(item, error)] for the items that failed; a cancellation stops everything and is re-raised
+def runBounded(items, func, workers):
+    work = queue.Queue()
+    failures = []
+    stop = []
+    for item in items:
+        work.put(item)
+
+    def worker():
+        while True:
+            item = work.get()
+            try:
+                if item is None:
+                    return
+                if not stop:
+                    func(item, work.put)
+            except Exception as e:
+                failures.append((item, e))
+            except BaseException as e:
+                stop.append(e)
+            finally:
+                work.task_done()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    work.join()
+    for thread in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    if stop:
+        raise stop[0]
+    return failures